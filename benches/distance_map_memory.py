@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Peak memory and time of building and writing the distance map of one long chain
+(make_distance_map -> filter_map_output -> write_tensor), as mkdmap.py does, next to
+the pipelines it replaced, which are reproduced here so one run gives before and after:
+  lists   - maps went through nested lists (.tolist() then np.array) on their way to disk
+  cast    - the map was built in float64 and then cast, how --float32 worked at first
+  current - the map is built in the requested dtype
+Peak memory is the largest traced allocation (tracemalloc, which sees NumPy's buffers).
+
+    python benches/distance_map_memory.py -n 2000 [--float32] [-atom CB]
+"""
+import os
+import sys
+import time
+import argparse
+import warnings
+import importlib
+import contextlib
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO.parent))
+mkdmap = importlib.import_module(f"{REPO.name}.mkdmap") # relative imports need the package
+
+def synthetic_pdb(n, seed=0):
+    """A single chain of `n` alanines on a random walk with 3.8 A steps, CA and CB atoms"""
+    rng  = np.random.default_rng(seed)
+    step = rng.normal(size=(n, 3))
+    ca   = np.cumsum(3.8 * step / np.linalg.norm(step, axis=1, keepdims=True), axis=0)
+    cb   = ca + 1.5 * rng.normal(size=(n, 3)) / np.sqrt(3)
+    lines = []
+    for i, (a, b) in enumerate(zip(ca, cb)):
+        for j, (name, xyz) in enumerate((('CA', a), ('CB', b))):
+            lines.append(f"ATOM  {(2 * i + j + 1) % 100000:5d}  {name:<3} ALA A{(i + 1) % 10000:4d}    "
+                         f"{xyz[0]:8.3f}{xyz[1]:8.3f}{xyz[2]:8.3f}  1.00  0.00           C")
+    return '\n'.join(lines + ['END']) + '\n'
+
+def arguments():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--residues", type=int, default=2000, help="Chain length")
+    parser.add_argument("-atom", choices=["CA", "CB"], default="CA", help="Atom type")
+    parser.add_argument("--float32", action='store_true', help="Store the map as float32")
+    return parser.parse_args()
+
+def _make_map(pdbfile, atom, dtype):
+    # the builder prints every chain's sequence
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return mkdmap.make_distance_map(pdbfile, atom=atom, dtype=dtype)
+
+def lists(pdbfile, atom, dtype):
+    chaindict = _make_map(pdbfile, atom, None)
+    for info in chaindict.values():
+        info['contact-map'] = np.array(info['contact-map'].tolist(), dtype=dtype)
+    return mkdmap.filter_map_output(chaindict)
+
+def cast(pdbfile, atom, dtype):
+    return mkdmap.filter_map_output(_make_map(pdbfile, atom, None), dtype=dtype)
+
+def current(pdbfile, atom, dtype):
+    return mkdmap.filter_map_output(_make_map(pdbfile, atom, dtype), dtype=dtype)
+
+PIPELINES = {'lists': lists, 'cast': cast, 'current': current}
+
+def measure(pipeline, pdbfile, atom, dtype, torch):
+    """(peak traced bytes, seconds) of one run of `pipeline` including the write"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    dmap_info = pipeline(pdbfile, atom, dtype)
+    if torch is not None:
+        chain = next(iter(dmap_info))
+        mkdmap.write_tensor(pdbfile.with_suffix('.pt'), dmap_info[chain]['contact-map'])
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, seconds
+
+if __name__ == '__main__':
+    args = arguments()
+    try:
+        import torch # imported up front so its own allocations are not counted
+    except ImportError:
+        torch = None
+        print("torch is not installed, write_tensor is skipped", file=sys.stderr)
+
+    dtype = 'float32' if args.float32 else None
+    print(f"{args.residues} residues, {args.atom}, {dtype or 'float64'}:")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pdbfile = Path(tmpdir) / 'synthetic.pdb'
+        pdbfile.write_text(synthetic_pdb(args.residues))
+        for name, pipeline in PIPELINES.items():
+            if name == 'cast' and dtype is None:
+                continue # nothing to cast
+            peak, seconds = measure(pipeline, pdbfile, args.atom, dtype, torch)
+            print(f"  {name:<8} {peak / 2**20:6.0f} MB peak, {seconds:.2f} s")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MB/s of reading a synthetic UniRef-like FASTA file with biotoolbox.gen.fasta_reader
+(str and raw records), next to the line-by-line groupby reader it replaced.
+Every record is consumed by taking its sequence length. Best of --repeat runs;
+run it twice to read from the page cache.
+
+    python benches/fasta_reader_throughput.py --size 256 [--width 60] [--gzip]
+    python benches/fasta_reader_throughput.py --size 200 --single-record  # one genome-scale record
+"""
+import io
+import sys
+import gzip
+import time
+import argparse
+import tempfile
+import itertools
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from biotoolbox.gen import fasta_reader
+
+AMINO_ACIDS = np.frombuffer(b'ACDEFGHIKLMNPQRSTVWY', dtype=np.uint8)
+
+def groupby_reader(handle):
+    """The itertools.groupby reader fasta_reader replaced"""
+    handle = gzip.open(handle, 'rt') if handle.suffix == '.gz' else open(handle, 'r')
+    with handle:
+        for is_header, group in itertools.groupby(handle, lambda line: line.startswith(">")):
+            if is_header:
+                header = group.__next__().strip()
+            else:
+                yield header, ''.join(line.strip() for line in group).strip().rstrip('*')
+
+def synthetic_fasta(path, size_mb, width=None, compress=False, single=False, seed=0):
+    """
+    Writes records with log-normal lengths (median ~300 residues) until the file holds `size_mb`,
+    or with `single` one record of `size_mb`, spanning many of the reader's chunks
+    returns:
+        :(records, uncompressed bytes) written
+    """
+    rng = np.random.default_rng(seed)
+    opener = gzip.open if compress else open
+    written, i = 0, 0
+    with opener(path, 'wb') as fileobj:
+        while written < size_mb * 2**20:
+            if single:
+                lengths = np.array([int(size_mb * 2**20)])
+            else:
+                lengths = np.clip(rng.lognormal(np.log(300), 0.6, size=1024), 20, 5000).astype(int)
+            residues = AMINO_ACIDS[rng.integers(len(AMINO_ACIDS), size=lengths.sum())].tobytes()
+            out, offset = io.BytesIO(), 0
+            for length in lengths:
+                seq = residues[offset:offset + length]
+                offset += length
+                if width:
+                    seq = b'\n'.join(seq[j:j + width] for j in range(0, len(seq), width))
+                out.write(b'>UniRef50_%09d n=%d Tax=Synthetic\n%s\n' % (i, length, seq))
+                i += 1
+            written += out.tell()
+            fileobj.write(out.getvalue())
+    return i, written
+
+def consume(records):
+    return sum(len(seq) for _, seq in records)
+
+def arguments():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=float, default=256, help="Uncompressed size of the test file in MB")
+    parser.add_argument("--width", type=int, default=None, help="Wrap sequences at this width (default single-line)")
+    parser.add_argument("--single-record", action='store_true', dest='single',
+                        help="Write one record of --size MB instead of UniRef-like records")
+    parser.add_argument("--gzip", action='store_true', help="Compress the test file")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per reader")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = arguments()
+    readers = {'groupby':     groupby_reader,
+               'chunked str': fasta_reader,
+               'chunked raw': lambda path: fasta_reader(path, raw=True)}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / ('synthetic.fasta.gz' if args.gzip else 'synthetic.fasta')
+        n, size = synthetic_fasta(path, args.size, width=args.width, compress=args.gzip, single=args.single)
+        print(f"{n} records, {size / 2**20:.0f} MB, {'wrapped at %d' % args.width if args.width else 'single-line'}"
+              f"{', gzip' if args.gzip else ''}")
+
+        expected = None
+        for name, reader in readers.items():
+            best = float('inf')
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                residues = consume(reader(path))
+                best = min(best, time.perf_counter() - start)
+            if expected is not None and residues != expected:
+                raise AssertionError(f"{name} read {residues} residues, expected {expected}")
+            expected = residues
+            print(f"  {name:<12} {size / 2**20 / best:7.1f} MB/s ({residues} residues, best of {args.repeat})")
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Rows per second written into a MemoryMappedDatasetWriter, one row at a time
+with set() and in blocks with set_many(). Best of --repeat runs.
+
+    python benches/mmdb_write_throughput.py -n 500000 -d 64 --shard-size 50000 --block 4096
+"""
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from biotoolbox.dbutils.mmdb import MemoryMappedDatasetWriter, STORAGE_DTYPES
+
+def write_rows(path, keys, matrix, shard_size, dtype):
+    writer = MemoryMappedDatasetWriter(path, embedding_dim=matrix.shape[1], shard_size=shard_size,
+                                       dtype=dtype, start=True)
+    for key, row in zip(keys, matrix):
+        writer.set(key, row)
+    writer.close()
+
+def write_blocks(path, keys, matrix, shard_size, dtype, block):
+    writer = MemoryMappedDatasetWriter(path, embedding_dim=matrix.shape[1], shard_size=shard_size,
+                                       dtype=dtype, start=True)
+    for start in range(0, len(keys), block):
+        writer.set_many(keys[start:start + block], matrix[start:start + block])
+    writer.close()
+
+def arguments():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--rows", type=int, default=500_000, help="Rows to write")
+    parser.add_argument("-d", "--dim", type=int, default=64, help="Embedding dimension")
+    parser.add_argument("--shard-size", type=int, default=50_000, help="Rows per shard")
+    parser.add_argument("--block", type=int, default=4096, help="Rows per set_many call")
+    parser.add_argument("--dtype", choices=STORAGE_DTYPES, default='float32', help="Storage dtype")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per mode")
+    parser.add_argument("--skip-set", action='store_true', help="Only time set_many")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = arguments()
+    matrix = np.random.default_rng(0).normal(size=(args.rows, args.dim)).astype(np.float32)
+    keys   = [f"UniRef50_{i:09d}" for i in range(args.rows)]
+
+    modes = {'set_many': lambda path: write_blocks(path, keys, matrix, args.shard_size, args.dtype, args.block)}
+    if not args.skip_set:
+        modes['set'] = lambda path: write_rows(path, keys, matrix, args.shard_size, args.dtype)
+
+    for name, write in modes.items():
+        best = float('inf')
+        for _ in range(args.repeat):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                start = time.perf_counter()
+                write(Path(tmpdir) / 'db')
+                best = min(best, time.perf_counter() - start)
+        print(f"{name:<8} {args.rows} x {args.dim} {args.dtype}: {args.rows / best:,.0f} rows/s (best of {args.repeat})")
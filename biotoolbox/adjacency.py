@@ -9,8 +9,11 @@
 Inducing adjacency matrix from distance map.
 """
 
+import itertools
 import functools
-import torch
+import contextlib
+import collections
+import concurrent.futures
 
 MISSING_RESIDUE = 1000.
 
@@ -55,6 +58,69 @@ class Composer(object):
     def __call__(self, x):
         return self._composition(x)
 
+    def imap(self, inputs, workers=0, processes=False, prefetch=8, batch_size=None):
+        """
+        Streams many inputs through the composition, stage by stage.
+        Each stage keeps at most `prefetch` items in flight, so stages overlap
+        while memory stays bounded, and outputs come back in input order.
+        args:
+            :inputs (iterable)                - items to feed to the first callable
+            :workers (int or sequence of int) - workers per stage (one value for all stages);
+                                                0 runs a stage in the consuming thread
+            :processes (bool)                 - use process pools instead of thread pools,
+                                                which requires picklable callables and items
+            :prefetch (int)                   - bound on the items (or batches) in flight per stage
+            :batch_size (int)                 - stages providing `convert_batch` receive lists of
+                                                up to `batch_size` items instead of single items
+        yields:
+            :the composition applied to each input
+        """
+        if isinstance(workers, int):
+            workers = [workers] * len(self)
+        if len(workers) != len(self):
+            raise ValueError(f"{len(workers)} worker counts for {len(self)} stages")
+        pool = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+
+        with contextlib.ExitStack() as stack:
+            stream = iter(inputs)
+            for stage, n in zip(self._callables, workers):
+                executor = stack.enter_context(pool(n)) if n else None
+                if batch_size and hasattr(stage, 'convert_batch'):
+                    batches = _bounded_map(stage.convert_batch, _batched(stream, batch_size), executor, prefetch)
+                    stream  = itertools.chain.from_iterable(batches)
+                else:
+                    stream  = _bounded_map(stage, stream, executor, prefetch)
+            yield from stream
+
+def _batched(iterable, n):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, n))
+        if not batch:
+            return
+        yield batch
+
+def _bounded_map(fn, iterable, executor, prefetch):
+    """Ordered map keeping at most `prefetch` calls in flight on `executor`"""
+    if executor is None:
+        yield from map(fn, iterable)
+        return
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= prefetch:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def _pad_square(matrices, fill):
+    """Stacks square matrices of varying size into one (B, N, N) tensor padded with `fill`"""
+    n = max(m.shape[0] for m in matrices)
+    padded = matrices[0].new_full((len(matrices), n, n), fill)
+    for b, m in enumerate(matrices):
+        padded[b, :m.shape[0], :m.shape[1]] = m
+    return padded
+
 class AdjacencyMatrixMaker(object):
     """Converts a distance map to an adjacency matrix"""
     def __init__(self, threshold, selfloop=True):
@@ -70,14 +136,82 @@ class AdjacencyMatrixMaker(object):
         return self._threshold
 
     def convert(self, distance_map):
-        A = distance_map.clone()
-        A = ( A <= self._threshold ).float()
+        if distance_map.is_sparse:
+            return self.convert_sparse(distance_map)
+        A = ( distance_map <= self._threshold ).float()
         if not self._selfloop:
-            n = A.shape[0]
-            mask = torch.eye(n).bool()
-            A.masked_fill_(mask, 0)
+            A.fill_diagonal_(0)
         return A
 
+    def convert_batch(self, distance_maps):
+        """
+        Thresholds a list of distance maps at once by padding the dense ones
+        into a single (B, N, N) batch. Sparse maps are converted one by one.
+        """
+        dense = [i for i, D in enumerate(distance_maps) if not D.is_sparse]
+        results = [self.convert(D) if D.is_sparse else None for D in distance_maps]
+        if dense:
+            A = ( _pad_square([distance_maps[i] for i in dense], float('inf')) <= self._threshold ).float()
+            if not self._selfloop:
+                A.diagonal(dim1=1, dim2=2).zero_()
+            for b, i in enumerate(dense):
+                n = distance_maps[i].shape[0]
+                results[i] = A[b, :n, :n]
+        return results
+
+    def convert_sparse(self, distance_map):
+        """
+        Thresholds a sparse COO distance map (as written by `mkdmap.py --cutoff`).
+        Absent pairs count as beyond the threshold. Sparse maps do not store the
+        diagonal, so self loops are added explicitly.
+        """
+        import torch
+
+        D = distance_map.coalesce()
+        indices = D.indices()
+        keep = (D.values() <= self._threshold) & (indices[0] != indices[1])
+        indices = indices[:, keep]
+        if self._selfloop:
+            diagonal = torch.arange(D.shape[0], device=indices.device).expand(2, -1)
+            indices  = torch.cat([indices, diagonal], dim=1)
+        values = torch.ones(indices.shape[1], dtype=torch.float32, device=indices.device)
+        return torch.sparse_coo_tensor(indices, values, D.shape).coalesce()
+
+    def edge_index(self, coords):
+        """
+        Coordinate-native thresholding: finds the pairs within the threshold with a
+        KD-tree neighbor search rather than through an N x N distance matrix.
+        args:
+            :coords (torch.Tensor) - N x 3 coordinates
+        returns:
+            :(2, E) LongTensor of directed edges (both directions, plus self loops if enabled)
+        """
+        import torch
+        from .neighbors import radius_pairs
+
+        n = coords.shape[0]
+        i, j, _ = radius_pairs(coords.detach().cpu().numpy(), self._threshold)
+        i, j = torch.from_numpy(i).long(), torch.from_numpy(j).long()
+        edges = [torch.stack([i, j]), torch.stack([j, i])]
+        if self._selfloop:
+            edges.append(torch.arange(n).expand(2, -1))
+        return torch.cat(edges, dim=1).to(coords.device)
+
+    def convert_coords(self, coords):
+        """
+        Coordinate-native counterpart of `convert`
+        args:
+            :coords (torch.Tensor) - N x 3 coordinates
+        returns:
+            :sparse N x N adjacency (torch.sparse_coo_tensor)
+        """
+        import torch
+
+        indices = self.edge_index(coords)
+        values  = torch.ones(indices.shape[1], dtype=torch.float32, device=indices.device)
+        n = coords.shape[0]
+        return torch.sparse_coo_tensor(indices, values, (n, n)).coalesce()
+
     def __call__(self, distance_map):
         return self.convert(distance_map)
 
@@ -85,15 +219,28 @@ class CoordLoader(object):
     """
     Converts an N x 3 matrix to an distance matrix
     """
-    def __init__(self, silent_if_square=True):
+    def __init__(self, silent_if_square=True, block_size=None, out=None, threshold=None):
         """
         initialize
         args:
             :silent_if_square (bool) - do nothing if the input matrix is already square
+            :block_size (int)        - if given, compute the distances `block_size` rows at a time
+                                       so temporaries stay bounded however large N gets
+            :out (str or Path)       - tiled mode only, write the distance matrix into a float32
+                                       np.memmap at this path instead of RAM
+            :threshold (float)       - tiled mode only, keep just the distances <= threshold
+                                       and return a sparse COO tensor
         """
         self.silent_if_square = silent_if_square
+        self.block_size = block_size
+        self.out = out
+        self.threshold = threshold
+        if block_size is None and (out is not None or threshold is not None):
+            raise ValueError("`out` and `threshold` require a block_size")
 
     def convert(self, coords):
+        import torch
+
         shape = coords.shape
         assert len(shape) == 2 
         
@@ -101,8 +248,64 @@ class CoordLoader(object):
             return coords # do nothing when the input is already a square matrix
         else:
             assert shape[1] == 3
+            if self.block_size is not None:
+                return self.convert_tiled(coords)
             return torch.cdist(coords, coords, p=2)
 
+    def convert_batch(self, coords_list):
+        """
+        Converts a list of coordinate sets with one padded, batched cdist.
+        Square inputs (when silent) and tiled mode are handled one by one.
+        """
+        import torch
+
+        batchable = [i for i, X in enumerate(coords_list)
+                     if self.block_size is None and not (self.silent_if_square and X.shape[0] == X.shape[1])]
+        results = [None if i in batchable else self.convert(X) for i, X in enumerate(coords_list)]
+        if batchable:
+            n = max(coords_list[i].shape[0] for i in batchable)
+            X = coords_list[batchable[0]].new_zeros((len(batchable), n, 3))
+            for b, i in enumerate(batchable):
+                X[b, :coords_list[i].shape[0]] = coords_list[i]
+            D = torch.cdist(X, X, p=2)
+            for b, i in enumerate(batchable):
+                m = coords_list[i].shape[0]
+                results[i] = D[b, :m, :m]
+        return results
+
+    def _blocks(self, coords):
+        """Yields (row offset, block of distances) pairs"""
+        import torch
+
+        for start in range(0, coords.shape[0], self.block_size):
+            yield start, torch.cdist(coords[start:start + self.block_size], coords, p=2)
+
+    def convert_tiled(self, coords):
+        """Row-blocked cdist, written to RAM, a disk-backed memmap or a sparse tensor"""
+        import torch
+
+        n = coords.shape[0]
+        if self.threshold is not None:
+            indices, values = [], []
+            for start, block in self._blocks(coords):
+                rows, cols = torch.nonzero(block <= self.threshold, as_tuple=True)
+                values.append(block[rows, cols])
+                indices.append(torch.stack([rows + start, cols]))
+            return torch.sparse_coo_tensor(torch.cat(indices, dim=1), torch.cat(values), (n, n))
+
+        if self.out is not None:
+            import numpy as np
+            memmap = np.memmap(self.out, dtype=np.float32, mode='w+', shape=(n, n))
+            for start, block in self._blocks(coords):
+                memmap[start:start + block.shape[0]] = block.detach().cpu().numpy()
+            memmap.flush()
+            return torch.from_numpy(memmap)
+
+        D = torch.empty((n, n), dtype=coords.dtype, device=coords.device)
+        for start, block in self._blocks(coords):
+            D[start:start + block.shape[0]] = block
+        return D
+
     def __call__(self, coords):
         return self.convert(coords)
 
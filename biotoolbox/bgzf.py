@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# bgzf.py
+
+"""
+Blocked gzip (BGZF), the format of `bgzip` and samtools: a series of gzip
+members of at most 64 KiB each, so a file stays readable by any gzip tool
+while each block can be located and inflated on its own. A `.gzi` sidecar
+maps block starts in the compressed file to offsets in the uncompressed data.
+"""
+
+import os
+import mmap
+import zlib
+import bisect
+import struct
+import collections
+
+__all__ = ['BGZF_BLOCK_SIZE', 'is_bgzf', 'BgzfWriter', 'BgzfReader', 'bgzip', 'read_gzi', 'write_gzi']
+
+BGZF_BLOCK_SIZE = 0xff00 # uncompressed bytes per block, as bgzip
+BGZF_HEADER = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+BGZF_EOF = BGZF_HEADER + b'\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+BGZF_BATCH = 64 # blocks inflated per task when streaming with threads
+
+def _gzi_path(path):
+    return f"{os.fspath(path)}.gzi"
+
+def is_bgzf(filepath):
+    """True if the file starts with a gzip member carrying the BGZF 'BC' extra field"""
+    with open(filepath, 'rb') as f:
+        header = f.read(18)
+    return len(header) == 18 and header[:4] == b'\x1f\x8b\x08\x04' and header[12:14] == b'BC'
+
+def _block_size(data, offset):
+    """Total compressed size of the block starting at `offset`"""
+    if data[offset:offset + 4] != b'\x1f\x8b\x08\x04':
+        raise ValueError(f"No BGZF block at offset {offset}")
+    xlen, = struct.unpack_from('<H', data, offset + 10)
+    extra = offset + 12
+    while extra < offset + 12 + xlen:
+        tag = data[extra:extra + 2]
+        slen, = struct.unpack_from('<H', data, extra + 2)
+        if tag == b'BC':
+            bsize, = struct.unpack_from('<H', data, extra + 4)
+            return bsize + 1
+        extra += 4 + slen
+    raise ValueError(f"Block at offset {offset} has no BGZF size field")
+
+def _inflate(data, offset, size):
+    """Uncompressed content of the block at `offset`, checked against its crc"""
+    xlen, = struct.unpack_from('<H', data, offset + 10)
+    crc, isize = struct.unpack_from('<II', data, offset + size - 8)
+    block = zlib.decompress(data[offset + 12 + xlen:offset + size - 8], -15, isize or 1)
+    if len(block) != isize or zlib.crc32(block) != crc:
+        raise ValueError(f"Corrupt BGZF block at offset {offset}")
+    return block
+
+def _inflate_many(data, spans):
+    return [_inflate(data, offset, size) for offset, size in spans]
+
+def write_gzi(blocks, gzi_path):
+    """
+    Write a `.gzi` index (a count, then compressed/uncompressed offset pairs, uint64
+    little endian) of every block but the first, which always starts at 0, 0
+    args:
+        :blocks (list of (int, int)) - compressed and uncompressed offset of each block
+    """
+    blocks = [block for block in blocks if block != (0, 0)]
+    with open(gzi_path, 'wb') as handle:
+        handle.write(struct.pack('<Q', len(blocks)))
+        handle.write(b''.join(struct.pack('<QQ', *block) for block in blocks))
+
+def read_gzi(gzi_path):
+    with open(gzi_path, 'rb') as handle:
+        data = handle.read()
+    count, = struct.unpack_from('<Q', data)
+    return [(0, 0)] + [struct.unpack_from('<QQ', data, 8 + 16 * i) for i in range(count)]
+
+class BgzfWriter(object):
+    """
+    File object compressing what is written to it into BGZF blocks. The block
+    offsets are kept so that a `.gzi` index can be written along with the file.
+    """
+    def __init__(self, path, level=6, index=True):
+        """
+        args:
+            :path (str or Path) - output file
+            :level (int)        - zlib compression level
+            :index (bool)       - write `<path>.gzi` on close
+        """
+        self.path = path
+        self.level = level
+        self.index = index
+        self.blocks = []
+        self.closed = False
+        self.__handle = open(path, 'wb')
+        self.__buffer = bytearray()
+        self.__offsets = [0, 0] # compressed and uncompressed bytes written so far
+
+    def _compress(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+        if len(cdata) + 26 > 2**16: # incompressible, store it instead
+            compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+            cdata = compressor.compress(data) + compressor.flush()
+        return b''.join([BGZF_HEADER, struct.pack('<H', len(cdata) + 25), cdata,
+                         struct.pack('<II', zlib.crc32(data), len(data))])
+
+    def _flush_block(self, data):
+        self.blocks.append(tuple(self.__offsets))
+        block = self._compress(data)
+        self.__handle.write(block)
+        self.__offsets[0] += len(block)
+        self.__offsets[1] += len(data)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.__buffer += data
+        full = len(self.__buffer) - len(self.__buffer) % BGZF_BLOCK_SIZE
+        view = memoryview(self.__buffer)
+        for start in range(0, full, BGZF_BLOCK_SIZE):
+            self._flush_block(view[start:start + BGZF_BLOCK_SIZE])
+        view.release()
+        del self.__buffer[:full]
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            if self.__buffer:
+                self._flush_block(bytes(self.__buffer))
+            self.__handle.write(BGZF_EOF)
+            self.__handle.close()
+            if self.index:
+                write_gzi(self.blocks, _gzi_path(self.path))
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def bgzip(infile, outfile=None, level=6, chunk_size=2**22):
+    """
+    Compress a file (plain or gzip) to BGZF with its `.gzi` index
+    args:
+        :infile (str or Path)  - file to compress
+        :outfile (str or Path) - defaults to `<infile>.gz`, or `<infile>.bgz` if infile is gzipped
+    returns:
+        :outfile
+    """
+    import gzip
+
+    with open(infile, 'rb') as handle:
+        gzipped = handle.read(2) == b'\x1f\x8b'
+    outfile = outfile or f"{os.fspath(infile)}.{'bgz' if gzipped else 'gz'}"
+    with (gzip.open if gzipped else open)(infile, 'rb') as source, BgzfWriter(outfile, level) as sink:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            sink.write(chunk)
+    return outfile
+
+class _BgzfStream(object):
+    """Read-only binary file object over the blocks of a BgzfReader, see BgzfReader.stream"""
+    def __init__(self, reader, blocks, closing=False):
+        self.__reader = reader
+        self.__blocks = blocks
+        self.__closing = closing
+        self.__pending = collections.deque()
+        self.__buffered = 0
+        self.closed = False
+
+    def read(self, size=-1):
+        while size is None or size < 0 or self.__buffered < size:
+            block = next(self.__blocks, None)
+            if block is None:
+                break
+            self.__pending.append(block)
+            self.__buffered += len(block)
+        data = b''.join(self.__pending)
+        if size is not None and 0 <= size < len(data):
+            data, rest = data[:size], data[size:]
+            self.__pending = collections.deque([rest])
+        else:
+            self.__pending.clear()
+        self.__buffered -= len(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.__blocks.close()
+            if self.__closing:
+                self.__reader.close()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BgzfReader(object):
+    """
+    Random access to the uncompressed content of a BGZF file. The compressed file
+    is memory mapped and the `.gzi` index (built by scanning the block headers if
+    absent) locates the blocks holding any byte range, so only those are inflated.
+    Recently inflated blocks are kept in an LRU cache.
+    """
+    def __init__(self, path, cache_blocks=64, start=True):
+        """
+        args:
+            :path (str or Path) - BGZF file
+            :cache_blocks (int) - inflated blocks kept in memory
+        """
+        self.path = path
+        self.gzi_path = _gzi_path(path)
+        self.cache_blocks = cache_blocks
+        self.coffsets = []
+        self.uoffsets = []
+        self.__cache = collections.OrderedDict()
+        self.__handle = None
+        self.__data = None
+        if start:
+            self.open()
+
+    def _scan(self, coffset=0, uoffset=0):
+        """(compressed, uncompressed) offsets of every block from the one at `coffset` on, read from the block headers"""
+        blocks, size = [], len(self.__data)
+        while coffset < size:
+            bsize = _block_size(self.__data, coffset)
+            isize, = struct.unpack_from('<I', self.__data, coffset + bsize - 4)
+            blocks.append((coffset, uoffset))
+            coffset += bsize
+            uoffset += isize
+        return blocks, uoffset
+
+    def open(self):
+        if self.__data is None:
+            self.__handle = open(self.path, 'rb')
+            self.__data = mmap.mmap(self.__handle.fileno(), 0, access=mmap.ACCESS_READ)
+            blocks = read_gzi(self.gzi_path) if os.path.exists(self.gzi_path) else [(0, 0)]
+            # the index does not give the length of its last block, which is read from there on
+            tail, self.size = self._scan(*blocks[-1])
+            blocks = blocks[:-1] + tail
+            self.coffsets = [coffset for coffset, _ in blocks] + [len(self.__data)]
+            self.uoffsets = [uoffset for _, uoffset in blocks] + [self.size]
+
+    def close(self):
+        if self.__data is not None:
+            self.__cache.clear()
+            self.__data.close()
+            self.__handle.close()
+            self.__data = None
+            self.__handle = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def write_index(self):
+        write_gzi(zip(self.coffsets[:-1], self.uoffsets[:-1]), self.gzi_path)
+
+    def _block(self, i):
+        """Inflated block i, through the cache"""
+        cache = self.__cache
+        if i in cache:
+            cache.move_to_end(i)
+            return cache[i]
+        block = _inflate(self.__data, self.coffsets[i], self.coffsets[i + 1] - self.coffsets[i])
+        cache[i] = block
+        if len(cache) > self.cache_blocks:
+            cache.popitem(last=False)
+        return block
+
+    def read_range(self, start, stop):
+        """
+        Uncompressed bytes [start, stop), inflating only the blocks they fall in
+        returns:
+            :bytes
+        """
+        start, stop = max(start, 0), min(stop, self.size)
+        if stop <= start:
+            return b''
+        first = bisect.bisect_right(self.uoffsets, start) - 1
+        last  = bisect.bisect_left(self.uoffsets, stop) - 1
+        data  = self._block(first) if first == last else b''.join(self._block(i) for i in range(first, last + 1))
+        origin = self.uoffsets[first]
+        return data[start - origin:stop - origin]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("BgzfReader only supports contiguous slices")
+        start, stop, _ = key.indices(self.size)
+        return self.read_range(start, stop)
+
+    def blocks(self, workers=None, prefetch=4):
+        """
+        Inflated blocks in file order. With workers, batches of blocks are
+        inflated on a thread pool (zlib releases the GIL) while they are consumed.
+        args:
+            :workers (int)  - threads, defaults to the number of CPUs; 0 or 1 inflates inline
+            :prefetch (int) - batches in flight per worker
+        yields:
+            :bytes
+        """
+        import concurrent.futures
+
+        spans = [(self.coffsets[i], self.coffsets[i + 1] - self.coffsets[i]) for i in range(len(self.coffsets) - 1)]
+        batches = [spans[i:i + BGZF_BATCH] for i in range(0, len(spans), BGZF_BATCH)]
+        workers = os.cpu_count() if workers is None else workers
+        if workers <= 1:
+            for batch in batches:
+                yield from _inflate_many(self.__data, batch)
+            return
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            pending = collections.deque()
+            for batch in batches:
+                pending.append(executor.submit(_inflate_many, self.__data, batch))
+                if len(pending) >= workers * prefetch:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def stream(self, workers=None, closing=False):
+        """
+        Binary file object reading the whole uncompressed content, see `blocks`
+        args:
+            :workers (int)   - inflating threads
+            :closing (bool)  - close this reader along with the stream
+        """
+        return _BgzfStream(self, self.blocks(workers), closing)
+
+if __name__ == '__main__':
+    pass
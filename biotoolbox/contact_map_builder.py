@@ -8,6 +8,7 @@ ALIGNED_BY_SEQRES = 'aligned by SEQRES'
 ATOMS_ONLY        = 'ATOM lines only'
 INCOMPARABLE_PAIR = 10000.
 KEY_NOT_FOUND     = 1000.
+PAIRWISE_BLOCK_ROWS = 256
 
 class ContactMapContainer:
     def __init__(self):
@@ -50,7 +51,21 @@ class DistanceMapBuilder:
                  atom="CA",
                  verbose=True,
                  pedantic=True,
-                 glycine_hack=-1):
+                 glycine_hack=-1,
+                 cutoff=None,
+                 dtype=np.float64):
+        """
+        args:
+            :atom (str)           - 'CA' or 'CB'
+            :verbose (bool)       - print progress
+            :pedantic (bool)      - raise on SEQRES/ATOM inconsistencies
+            :glycine_hack (float) - distance for CB pairs involving a residue without CB,
+                                    negative values fall back to the CA-CA distance
+            :cutoff (float)       - if given, maps are sparse (scipy.sparse.coo_matrix) and hold
+                                    only the off-diagonal pairs within `cutoff`
+            :dtype                - type maps and coordinates are built in, float32 halves the
+                                    memory of the N x N map
+        """
 
         self.verbose = verbose
         self.pedantic = pedantic
@@ -58,6 +73,10 @@ class DistanceMapBuilder:
         if not isinstance(glycine_hack, (int, float)):
             raise ValueError(f"{glycine_hack} is not an int")
         self.glycine_hack = glycine_hack
+        if cutoff is not None and not cutoff > 0:
+            raise ValueError(f"{cutoff} is not a positive cutoff")
+        self.cutoff = cutoff
+        self.dtype = np.dtype(dtype)
 
     def speak(self, *args, **kwargs):
         """
@@ -213,8 +232,80 @@ class DistanceMapBuilder:
 
         return contact_maps
 
+    def generate_map_for_atom_table(self, atom_table):
+        """
+        Counterpart of `generate_map_for_pdb` for the structured arrays returned by
+        `coordinate_reader.read_atom_table`, which never builds per-atom objects.
+        Chains are handled as in the ATOM-lines-only path, except that chains without
+        any CA atom are left out rather than given an empty map.
+        """
+        contact_maps = ContactMapContainer()
+
+        for chain_name in np.unique(atom_table['chain']):
+            chain = atom_table[atom_table['chain'] == chain_name]
+            # chains without a single amino acid have no ATOM sequence
+            if not any(resname in protein_letters_3to1 for resname in np.unique(chain['resname'])):
+                continue
+            chain_name = str(chain_name)
+            contact_maps.with_chain(chain_name)
+            contact_maps.with_method_for_chain(chain_name, ATOMS_ONLY)
+            self.speak(f"\nProcessing chain {chain_name}")
+
+            # residues in order of first appearance
+            _, first, residue_index = np.unique(chain[['resseq', 'icode']],
+                                                return_index=True, return_inverse=True)
+            order = np.argsort(first)
+            rank  = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            residue_index = rank[residue_index.ravel()]
+            resnames = chain['resname'][first[order]]
+
+            ca_coords, ca_present = self.__gather_table_coords(chain, residue_index, len(order), 'CA')
+            # residues missing CA are dropped, as in the ATOM-lines-only path
+            ca_coords, resnames = ca_coords[ca_present], resnames[ca_present]
+            kept = np.cumsum(ca_present) - 1
+            has_ca = ca_present[residue_index]
+            chain, residue_index = chain[has_ca], kept[residue_index[has_ca]]
+            ca_present = np.ones(len(ca_coords), dtype=bool)
+
+            if self.atom == 'CA':
+                atom_coords, atom_present = ca_coords, ca_present
+            else:
+                atom_coords, atom_present = self.__gather_table_coords(chain, residue_index,
+                                                                       len(ca_coords), self.atom)
+
+            final_seq_one_letter_codes = seq1(''.join(resnames), undef_code='-',
+                                              custom_map=protein_letters_3to1)
+            self.speak(final_seq_one_letter_codes)
+            contact_maps.with_chain_seq(chain_name, final_seq_one_letter_codes)
+
+            missing = np.zeros(len(ca_coords), dtype=bool)
+            if self.cutoff is not None:
+                contact_map = self.__sparse_distances_from_coords(atom_coords, atom_present,
+                                                                  ca_coords, ca_present, missing)
+            else:
+                dist_matrix = self.__distances_from_coords(atom_coords, atom_present,
+                                                           ca_coords, ca_present, missing)
+                contact_map = self.__diagnolize_to_fill_gaps(dist_matrix, len(final_seq_one_letter_codes))
+            contact_maps.with_map_for_chain(chain_name, contact_map)
+            contact_maps.with_xyz_for_chain(chain_name, ca_coords.astype(self.dtype))
+
+        return contact_maps
+
+    def __gather_table_coords(self, chain, residue_index, n_residues, atom):
+        """Table counterpart of `__gather_coords`: scatter `atom` rows onto their residues"""
+        coords  = np.zeros((n_residues, 3), dtype=np.float32)
+        present = np.zeros(n_residues, dtype=bool)
+        rows = chain['name'] == atom
+        coords[residue_index[rows]]  = chain['coord'][rows]
+        present[residue_index[rows]] = True
+        return coords, present
+
     def __residue_list_to_contact_map(self, residue_list, length):
         dist_matrix, coord_matrix = self.__calc_dist_matrix(residue_list)
+        if self.cutoff is not None:
+            # sparse maps store no entries for missing residues, so there are no gaps to fill
+            return dist_matrix, coord_matrix
         diag = self.__diagnolize_to_fill_gaps(dist_matrix, length)
         #contact_map = self.__create_adj(diag, TEN_ANGSTROMS)
         contact_map = diag
@@ -243,35 +334,96 @@ class DistanceMapBuilder:
 
         return A
 
-    def __calc_residue_dist(self, residue_one, residue_two):
-        """Returns the `self.atom` distance between two residues"""
-        if bool({residue_one, residue_two} & {None}): 
-            return INCOMPARABLE_PAIR
-        try:
-            dist = self.__euclidean(residue_one, self.atom,
-                                    residue_two, self.atom)
-        except KeyError:
-            if self.atom == "CB":
-                if self.glycine_hack < 0: # CA-mode for CB+GLY
-                    try:
-                        dist = self.__euclidean(residue_one,'CA',
-                                                residue_two,'CA')
-                    except KeyError:
-                        dist = KEY_NOT_FOUND
-                else:
-                    dist = self.glycine_hack
+    def __gather_coords(self, residue_list, atom):
+        """
+        Collects the coordinates of `atom` for every residue into an (N, 3) array
+        alongside a mask of the residues that actually have that atom.
+        """
+        coords  = np.zeros((len(residue_list), 3), dtype=np.float32)
+        present = np.zeros(len(residue_list), dtype=bool)
+        for i, residue in enumerate(residue_list):
+            if residue is None:
+                continue
+            try:
+                coords[i] = residue[atom].get_coord()
+                present[i] = True
+            except KeyError:
+                pass
+        return coords, present
+
+    def __pairwise_euclidean(self, coords_one, coords_two):
+        # (B, N, 1, 3) @ (B, N, 3, 1) reduces each pair with the same dot product
+        # Biopython uses for `Atom.__sub__`, so results are bit-identical to it
+        diff = coords_one[:, None, :] - coords_two[None, :, :]
+        return np.sqrt(np.matmul(diff[..., None, :], diff[..., :, None])[..., 0, 0])
+
+    def __distances_from_coords(self, atom_coords, atom_present, ca_coords, ca_present, missing):
+        """
+        Batched counterpart of comparing every residue pair by `self.atom`.
+        Pairs lacking `self.atom` fall back to CA-CA (or `glycine_hack`) in CB mode,
+        pairs lacking both get KEY_NOT_FOUND and pairs involving a missing
+        residue get INCOMPARABLE_PAIR.
+        Rows are filled in blocks so temporaries stay small next to the N x N output.
+        """
+        n = len(atom_coords)
+        answer = np.empty((n, n), dtype=self.dtype)
+        for start in range(0, n, PAIRWISE_BLOCK_ROWS):
+            rows  = slice(start, start + PAIRWISE_BLOCK_ROWS)
+            block = answer[rows]
+            if self.atom == "CB" and self.glycine_hack < 0: # CA-mode for CB+GLY
+                block[...] = KEY_NOT_FOUND
+                np.copyto(block, self.__pairwise_euclidean(ca_coords[rows], ca_coords),
+                          where=ca_present[rows, None] & ca_present[None, :])
+            elif self.atom == "CB":
+                block[...] = self.glycine_hack
             else:
-                dist = KEY_NOT_FOUND
-        return dist
-                
-    def __euclidean(self, res1, atom1, res2, atom2):
-        diff = res1[atom1] - res2[atom2]
-        return np.sqrt(np.sum(diff * diff))
+                block[...] = KEY_NOT_FOUND
+            np.copyto(block, self.__pairwise_euclidean(atom_coords[rows], atom_coords),
+                      where=atom_present[rows, None] & atom_present[None, :])
 
+        answer[missing, :] = INCOMPARABLE_PAIR
+        answer[:, missing] = INCOMPARABLE_PAIR
+        return answer
+
+    def __sparse_distances_from_coords(self, atom_coords, atom_present, ca_coords, ca_present, missing):
+        """
+        Sparse counterpart of `__distances_from_coords` holding only the pairs within
+        `self.cutoff`, found by KD-tree search instead of comparing all pairs.
+        Fallbacks follow the dense map; KEY_NOT_FOUND and INCOMPARABLE_PAIR
+        pairs are never stored, neither is the diagonal.
+        returns:
+            :symmetric scipy.sparse.coo_matrix
+        """
+        from scipy.sparse import coo_matrix
+        from .neighbors import radius_pairs
+
+        n = len(atom_coords)
+        atom_present = atom_present & ~missing
+        ca_present   = ca_present & ~missing
+        pairs = [radius_pairs(atom_coords, self.cutoff, atom_present)]
+
+        if self.atom == "CB":
+            lacking = ~atom_present & ~missing
+            if self.glycine_hack < 0: # CA-mode for CB+GLY
+                i, j, d = radius_pairs(ca_coords, self.cutoff, ca_present)
+                fallback = lacking[i] | lacking[j]
+                pairs.append((i[fallback], j[fallback], d[fallback]))
+            elif self.glycine_hack <= self.cutoff:
+                # every pair involving a residue without CB sits at `glycine_hack`
+                i = np.repeat(np.flatnonzero(lacking), n)
+                j = np.tile(np.arange(n), lacking.sum())
+                keep = (i != j) & ~missing[j] & ~(lacking[j] & (j < i))
+                i, j = np.minimum(i[keep], j[keep]), np.maximum(i[keep], j[keep])
+                pairs.append((i, j, np.full(len(i), self.glycine_hack, dtype=atom_coords.dtype)))
+
+        i, j, d = (np.concatenate(part) for part in zip(*pairs))
+        return coo_matrix((np.concatenate([d, d]).astype(self.dtype),
+                           (np.concatenate([i, j]), np.concatenate([j, i]))), shape=(n, n))
 
     def __diagnolize_to_fill_gaps(self, distance_matrix, length):
         # Create CMAP from distance
-        A = distance_matrix.copy()
+        # fills in place, the distance matrix is always freshly built by the caller
+        A = distance_matrix
         for i in range(length):
             if A[i][i] == INCOMPARABLE_PAIR:
                 A[i][i] = 1.0
@@ -287,14 +439,20 @@ class DistanceMapBuilder:
         return A
 
     def __calc_dist_matrix(self, chain_one):
-        """Returns a matrix of C-alpha distances between two chains"""
-        answer = np.zeros((len(chain_one), len(chain_one)), np.float)
-        coord_matrix = np.zeros((len(chain_one), 3))
-        for row, residue_one in enumerate(chain_one):
-            coord_matrix[row, :] = residue_one['CA'].get_coord()
-            for col, residue_two in enumerate(chain_one[row:], start=row):
-                if col >= len(chain_one):
-                    continue  # enumerate syntax is convenient, but results in invalid indices on last column
-                answer[row, col] = self.__calc_residue_dist(residue_one, residue_two)
-                answer[col, row] = answer[row, col]  # cchandler
+        """Returns a matrix of `self.atom` distances between all residues of a chain"""
+        missing = np.array([residue is None for residue in chain_one], dtype=bool)
+        ca_coords, ca_present = self.__gather_coords(chain_one, 'CA')
+        if self.atom == 'CA':
+            atom_coords, atom_present = ca_coords, ca_present
+        else:
+            atom_coords, atom_present = self.__gather_coords(chain_one, self.atom)
+
+        if self.cutoff is not None:
+            answer = self.__sparse_distances_from_coords(atom_coords, atom_present,
+                                                         ca_coords, ca_present, missing)
+        else:
+            answer = self.__distances_from_coords(atom_coords, atom_present,
+                                                  ca_coords, ca_present, missing)
+        coord_matrix = ca_coords.astype(self.dtype)
+        coord_matrix[missing] = np.nan
         return answer, coord_matrix
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# coordinate_reader.py
+
+"""
+Columnar reader for the ATOM/HETATM records of PDB and mmCIF files.
+Records of the first model are returned as one NumPy structured array
+rather than a Bio.PDB object tree.
+"""
+
+import re
+
+import numpy as np
+
+__all__ = ['ATOM_RECORD_DTYPE', 'read_atom_table']
+
+ATOM_RECORD_DTYPE = np.dtype([('chain',     'U4'),
+                              ('resseq',    'i4'),
+                              ('icode',     'U1'),
+                              ('resname',   'U5'),
+                              ('name',      'U4'),
+                              ('hetero',    '?'),
+                              ('occupancy', 'f4'),
+                              ('coord',     'f4', (3,))])
+
+PDB_LINE_WIDTH = 80
+CIF_TOKEN      = re.compile(r"""'(?:[^']|'(?=\S))*'|"(?:[^"]|"(?=\S))*"|\S+""")
+# first present field wins, as Bio.PDB.MMCIFParser prefers author numbering
+CIF_COLUMNS    = {'group':     ('_atom_site.group_PDB',),
+                  'name':      ('_atom_site.label_atom_id',),
+                  'resname':   ('_atom_site.label_comp_id',),
+                  'chain':     ('_atom_site.auth_asym_id', '_atom_site.label_asym_id'),
+                  'resseq':    ('_atom_site.auth_seq_id', '_atom_site.label_seq_id'),
+                  'icode':     ('_atom_site.pdbx_PDB_ins_code',),
+                  'occupancy': ('_atom_site.occupancy',),
+                  'x':         ('_atom_site.Cartn_x',),
+                  'y':         ('_atom_site.Cartn_y',),
+                  'z':         ('_atom_site.Cartn_z',),
+                  'model':     ('_atom_site.pdbx_PDB_model_num',)}
+
+def _select_alternate_locations(table):
+    """
+    Resolve alternate locations the way Bio.PDB does: a point-mutated residue keeps
+    the residue name added last and every atom keeps its highest occupancy
+    location (the first one on ties). File order is preserved.
+    """
+    if len(table) == 0:
+        return table
+    index = np.arange(len(table))
+
+    _, residue = np.unique(table[['chain', 'resseq', 'icode']], return_inverse=True)
+    residue = residue.ravel()
+    last = np.zeros(residue.max() + 1, dtype=np.intp)
+    np.maximum.at(last, residue, index)
+    table = table[table['resname'] == table['resname'][last][residue]]
+
+    _, atom = np.unique(table[['chain', 'resseq', 'icode', 'name']], return_inverse=True)
+    atom  = atom.ravel()
+    order = np.lexsort((np.arange(len(table)), -table['occupancy'], atom))
+    first = order[np.r_[True, atom[order][1:] != atom[order][:-1]]]
+    return table[np.sort(first)]
+
+def _read_pdb(structure_data, atoms):
+    end_of_model = re.search('^ENDMDL', structure_data, re.MULTILINE)
+    if end_of_model is not None:
+        structure_data = structure_data[:end_of_model.start()]
+
+    lines = [line.ljust(PDB_LINE_WIDTH)[:PDB_LINE_WIDTH]
+             for line in structure_data.splitlines()
+             if line.startswith(('ATOM  ', 'HETATM'))]
+    if not lines:
+        return np.zeros(0, dtype=ATOM_RECORD_DTYPE)
+
+    # (n, 80) character grid, sliced by the fixed PDB columns
+    grid = np.frombuffer(''.join(lines).encode('ascii', 'replace'), dtype='S1').reshape(-1, PDB_LINE_WIDTH)
+
+    def column(start, stop):
+        return np.ascontiguousarray(grid[:, start:stop]).view(f'S{stop - start}')[:, 0]
+
+    names = np.char.strip(column(12, 16))
+    if atoms is not None:
+        keep  = np.isin(names, [atom.encode() for atom in atoms])
+        grid  = grid[keep]
+        names = names[keep]
+
+    table = np.zeros(len(grid), dtype=ATOM_RECORD_DTYPE)
+    occupancy = np.char.strip(column(54, 60))
+    table['hetero']    = column(0, 6) == b'HETATM'
+    table['name']      = names.astype('U4')
+    table['resname']   = np.char.strip(column(17, 20)).astype('U5')
+    table['chain']     = column(21, 22).astype('U4')
+    table['resseq']    = column(22, 26).astype(np.int32)
+    table['icode']     = column(26, 27).astype('U1')
+    table['occupancy'] = np.where(occupancy == b'', b'1', occupancy).astype(np.float32)
+    table['coord']     = np.stack([column(30, 38).astype(np.float32),
+                                   column(38, 46).astype(np.float32),
+                                   column(46, 54).astype(np.float32)], axis=1)
+    return table
+
+def _cif_atom_site_loop(structure_data):
+    """Returns the column names and the data lines of the `_atom_site` loop"""
+    lines = iter(structure_data.splitlines())
+    columns = []
+    for line in lines:
+        if line.startswith('_atom_site.'):
+            columns.append(line.split()[0])
+            break
+
+    rows = []
+    for line in lines:
+        if line.startswith('_atom_site.'):
+            columns.append(line.split()[0])
+        elif line.startswith(('#', 'loop_', '_')):
+            break
+        elif line.strip():
+            rows.append(line)
+    return columns, rows
+
+def _read_cif(structure_data, atoms):
+    columns, rows = _cif_atom_site_loop(structure_data)
+    if not rows:
+        return np.zeros(0, dtype=ATOM_RECORD_DTYPE)
+
+    position = {}
+    for name, candidates in CIF_COLUMNS.items():
+        present = [field for field in candidates if field in columns]
+        if present:
+            position[name] = columns.index(present[0])
+    atoms    = None if atoms is None else set(atoms)
+    model    = None
+    records  = []
+    for row in rows:
+        tokens = row.split() if ('"' not in row and "'" not in row) else \
+                 [token.strip('\'"') for token in CIF_TOKEN.findall(row)]
+        if 'model' in position:
+            if model is None:
+                model = tokens[position['model']]
+            elif tokens[position['model']] != model:
+                break # first model only
+        name = tokens[position['name']]
+        if atoms is not None and name not in atoms:
+            continue
+        icode = tokens[position['icode']] if 'icode' in position else '?'
+        occupancy = tokens[position['occupancy']] if 'occupancy' in position else '?'
+        records.append((tokens[position['chain']],
+                        int(tokens[position['resseq']]),
+                        ' ' if icode in '?.' else icode,
+                        tokens[position['resname']],
+                        name,
+                        tokens[position['group']] == 'HETATM',
+                        1.0 if occupancy in '?.' else float(occupancy),
+                        (float(tokens[position['x']]),
+                         float(tokens[position['y']]),
+                         float(tokens[position['z']]))))
+    return np.array(records, dtype=ATOM_RECORD_DTYPE)
+
+def read_atom_table(structure_data, atoms=None):
+    """
+    Read the ATOM/HETATM records of the first model of a PDB or mmCIF file
+    args:
+        :structure_data (str) - contents of the structure file
+        :atoms (iterable)     - atom names to keep (e.g. ('CA', 'CB')), None keeps all
+    returns:
+        :np.ndarray of ATOM_RECORD_DTYPE, one row per atom in file order
+    """
+    if re.search('^_', structure_data, re.MULTILINE) is None:
+        table = _read_pdb(structure_data, atoms)
+    else:
+        table = _read_cif(structure_data, atoms)
+    return _select_alternate_locations(table)
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Build the `trained*index` files `load_knn_db` serves from a dataset
+written by MemoryMappedDatasetWriter.
+"""
+import json
+import time
+import resource
+from pathlib import Path
+
+import numpy as np
+
+from .mmdb import MemoryMappedDatasetReader
+from .index import KNNDatabase, BruteForceIndex
+
+__all__ = ['INDEX_KINDS', 'build_index', 'index_filename', 'recall_at_k']
+
+INDEX_KINDS = ('flat', 'ivf', 'ivfpq', 'kdtree')
+
+def index_filename(kind):
+    """Name `load_knn_db` recognizes for an index of this kind"""
+    return "trained_kdtree.index" if kind == 'kdtree' else f"trained_faiss_{kind}.index"
+
+def _default_nlist(n, sample_size):
+    return int(max(1, min(4 * np.sqrt(n), min(n, sample_size) // 39))) # faiss wants >= 39 training points per list
+
+def _default_pq_m(d):
+    """Largest number of subquantizers <= 64 dividing d, with at least 2 dims each"""
+    return max([m for m in range(1, min(64, d // 2) + 1) if d % m == 0] or [1])
+
+def _sample_rows(reader, size, seed):
+    """Random row ids, sorted so each shard is read in order"""
+    n = len(reader)
+    return np.sort(np.random.default_rng(seed).choice(n, size=min(size, n), replace=False))
+
+def _sample(reader, size, seed):
+    """Random rows gathered shard by shard"""
+    return np.ascontiguousarray(reader.embedding_matrix.take(_sample_rows(reader, size, seed)), dtype=np.float32)
+
+def _drop_self(ids, rows, k):
+    """First k neighbors of every query row other than the row itself"""
+    ids = np.asarray(ids)
+    return np.stack([found[found != row][:k] for found, row in zip(ids, rows)])
+
+def recall_at_k(approximate, exact):
+    """
+    Fraction of the exact neighbors retrieved
+    args:
+        :approximate (np.ndarray) - (Q, k) ids found by the index
+        :exact (np.ndarray)       - (Q, k) ids found by exact search
+    """
+    hits = [len(np.intersect1d(found, truth)) for found, truth in zip(approximate, exact)]
+    return float(np.sum(hits) / exact.size)
+
+def _peak_rss():
+    """Peak resident set size of this process so far, in bytes (ru_maxrss is in KiB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def build_index(database_path, kind='flat', sample_size=2**16, batch_size=2**14,
+                nlist=None, m=None, nbits=8, nprobe=8, leaf_size=40,
+                evaluate=True, k=10, n_queries=256, seed=0):
+    """
+    Train an index on a sample of the dataset, add every vector shard by shard
+    in batches of `batch_size` rows and write it beside the dataset as
+    `index_filename(kind)`, with the build parameters and report in `<index>.json`.
+    A KD-tree cannot be built incrementally, so `kdtree` loads the full matrix.
+    args:
+        :database_path (Path or str) - dataset root
+        :kind (str)                  - one of INDEX_KINDS
+        :sample_size (int)           - rows to train IVF coarse quantizers and PQ codebooks on
+        :batch_size (int)            - rows added to the index at a time
+        :nlist (int)                 - IVF lists, defaults to ~4 sqrt(N)
+        :m (int)                     - PQ subquantizers, must divide the dimension
+        :nbits (int)                 - bits per PQ code
+        :nprobe (int)                - IVF lists visited per query, stored with the index
+        :leaf_size (int)             - KD-tree leaf size
+        :evaluate (bool)             - measure recall@k against exact brute force search
+        :k (int)                     - neighbors for the recall measurement
+        :n_queries (int)             - dataset rows used as recall queries, their self
+                                       matches are left out of the recall
+        :seed (int)                  - seed of the training and query samples
+    returns:
+        :dict of the parameters and the build report, as saved in the json file
+    """
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind {kind} (not in {INDEX_KINDS})")
+    database_path = Path(database_path)
+    reader = MemoryMappedDatasetReader(database_path, start=True)
+    try:
+        N, d = reader.shape
+        if N == 0:
+            raise ValueError(f"{database_path} holds no vectors")
+
+        params = dict(kind=kind, n=N, d=d, dtype=str(reader.embedding_matrix.dtype))
+        start = time.perf_counter()
+        if kind == 'kdtree':
+            from sklearn.neighbors import KDTree
+            params.update(leaf_size=leaf_size)
+            index = KDTree(np.asarray(reader.embedding_matrix), leaf_size=leaf_size)
+        else:
+            import faiss
+            if kind == 'flat':
+                index = faiss.IndexFlatL2(d)
+            else:
+                nlist = nlist or _default_nlist(N, sample_size)
+                quantizer = faiss.IndexFlatL2(d)
+                if kind == 'ivf':
+                    index = faiss.IndexIVFFlat(quantizer, d, nlist)
+                else:
+                    m = m or _default_pq_m(d)
+                    index = faiss.IndexIVFPQ(quantizer, d, nlist, m, nbits)
+                    params.update(m=m, nbits=nbits)
+                params.update(nlist=nlist, nprobe=nprobe, sample_size=min(sample_size, N))
+                index.train(_sample(reader, sample_size, seed))
+                index.nprobe = nprobe
+            # faiss numbers vectors in the order they are added, i.e. by row id
+            for _, block in reader.embedding_matrix.blocks(batch_size):
+                index.add(np.ascontiguousarray(block, dtype=np.float32))
+
+        index_file = database_path / index_filename(kind)
+        if kind == 'kdtree':
+            import joblib
+            joblib.dump(index, index_file)
+        else:
+            faiss.write_index(index, str(index_file))
+        params.update(build_seconds=time.perf_counter() - start, peak_rss_bytes=_peak_rss(),
+                      index_bytes=index_file.stat().st_size)
+
+        if evaluate:
+            # KNNDatabase closes its reader when collected, so both stay referenced until done
+            approximate, exact = KNNDatabase(reader, index), KNNDatabase(reader, BruteForceIndex(reader))
+            rows    = _sample_rows(reader, n_queries, seed + 1)
+            queries = np.ascontiguousarray(reader.embedding_matrix.take(rows), dtype=np.float32)
+            # queries are indexed rows, their trivial self matches would inflate recall
+            _, found = approximate.search(queries, k=k + 1)
+            _, truth = exact.search(queries, k=k + 1)
+            params.update(k=k, n_queries=len(queries),
+                          recall_at_k=recall_at_k(_drop_self(found, rows, k), _drop_self(truth, rows, k)))
+
+        with open(index_file.with_name(index_file.name + '.json'), 'w') as fileobj:
+            json.dump(params, fileobj, indent=2)
+        return params
+    finally:
+        reader.close()
+
+if __name__ == '__main__':
+    pass
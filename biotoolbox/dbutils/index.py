@@ -1,15 +1,85 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
 from pathlib import Path
+from multiprocessing.pool import ThreadPool
 
-import faiss
-import joblib
 import numpy as np
-from sklearn.neighbors import KDTree
 
 from .mmdb import MemoryMappedDatasetReader
 
-__all__ = ['KNNDatabase', 'load_knn_db']
+__all__ = ['KNNDatabase', 'BruteForceIndex', 'load_knn_db']
+
+def _smallest_k(distances, ids, k):
+    """Keep the k smallest distances of every row (in no particular order)"""
+    if distances.shape[1] <= k:
+        return distances, ids
+    keep = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(distances, keep, axis=1), np.take_along_axis(ids, keep, axis=1)
+
+class BruteForceIndex(object):
+    """
+    Exact nearest neighbor search straight over the shards of a MemoryMappedDatasetReader.
+    Distances to each block of rows come from one matrix multiply, a running top-k
+    is kept per query, and shards are searched in parallel threads (the heavy
+    NumPy calls release the GIL). Mirrors faiss's `search`, so it can stand in for
+    a faiss index and serve as the exact baseline for approximate ones.
+    """
+    def __init__(self, reader, block_rows=2**14, workers=None):
+        """
+        args:
+            :reader (MemoryMappedDatasetReader) - open dataset to search
+            :block_rows (int)                   - rows per distance block, bounds the
+                                                  (Q, block_rows) temporaries
+            :workers (int)                      - threads across shards, defaults to the cpu count
+        """
+        self.reader = reader
+        self.block_rows = block_rows
+        self.workers = workers or os.cpu_count()
+
+    @property
+    def ntotal(self):
+        return len(self.reader)
+
+    def _search_shard(self, xq, q_norms, k, shard):
+        matrix = self.reader.embedding_matrix
+        best_d = np.empty((len(xq), 0), dtype=np.float32)
+        best_i = np.empty((len(xq), 0), dtype=np.int64)
+        for start, block in matrix.blocks(self.block_rows, shard=shard):
+            block = np.asarray(block, dtype=np.float32)
+            distances = q_norms[:, None] - 2 * (xq @ block.T) + np.einsum('ij,ij->i', block, block)[None, :]
+            np.maximum(distances, 0, out=distances)
+            ids = np.broadcast_to(np.arange(start, start + len(block)), distances.shape)
+            best_d, best_i = _smallest_k(np.hstack([best_d, distances]), np.hstack([best_i, ids]), k)
+        return best_d, best_i
+
+    def search(self, xq, k):
+        """
+        Find the k nearest rows of every query
+        args:
+            :xq (np.ndarray) - (Q, d) queries
+            :k (int)         - neighbors per query
+        returns:
+            :(distances, ids), both (Q, k) and sorted by distance. Distances are squared L2
+             like faiss's IndexFlatL2 (KNNDatabase.search turns them into Euclidean
+             distances); when there are fewer than k rows, the missing neighbors get
+             distance inf and id -1.
+        """
+        xq = np.ascontiguousarray(xq, dtype=np.float32)
+        q_norms = np.einsum('ij,ij->i', xq, xq)
+        shards  = range(len(self.reader.embedding_matrix.shards))
+        search  = lambda shard: self._search_shard(xq, q_norms, k, shard)
+        if self.workers > 1 and len(shards) > 1:
+            with ThreadPool(min(self.workers, len(shards))) as pool:
+                results = pool.map(search, shards)
+        else:
+            results = list(map(search, shards))
+
+        distances = np.hstack([np.full((len(xq), k), np.inf, dtype=np.float32)] + [d for d, _ in results])
+        ids       = np.hstack([np.full((len(xq), k), -1, dtype=np.int64)] + [i for _, i in results])
+        distances, ids = _smallest_k(distances, ids, k)
+        order = np.argsort(distances, axis=1, kind='stable')
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
 
 class KNNDatabase(object):
     """
@@ -22,7 +92,7 @@ class KNNDatabase(object):
         Initialize the index.
         args:
             :reader (MemoryMappedDatasetReader)
-            :index  (sklearn.neighbors.KDTree) 
+            :index  (sklearn.neighbors.KDTree, faiss index or BruteForceIndex) 
         """
         self.__db  = reader
         self.__idx = index
@@ -31,16 +101,49 @@ class KNNDatabase(object):
         elif hasattr(self.__idx, 'search'):
             self.query = self.__idx.search
 
+    def search(self, xq, k=8):
+        """
+        Backend-neutral search of the index
+        args:
+            :xq (np.ndarray) - (Q, d) queries
+            :k (int)         - neighbors per query
+        returns:
+            :(distances, ids), both (Q, k). L2 backends (KDTree, BruteForceIndex, faiss
+             L2 indexes) give Euclidean distances, faiss's squared ones are square
+             rooted; other faiss metrics (e.g. inner product) are returned as faiss
+             scores them. (faiss pads missing neighbors with id -1)
+        """
+        if hasattr(self.__idx, 'query'):
+            return self.__idx.query(xq, k=k, return_distance=True)
+        # faiss only takes contiguous float32
+        distances, ids = self.__idx.search(np.ascontiguousarray(xq, dtype=np.float32), k)
+        if hasattr(self.__idx, 'metric_type'):
+            import faiss # only faiss indexes carry a metric
+            if self.__idx.metric_type != faiss.METRIC_L2:
+                return distances, ids
+        return np.sqrt(np.maximum(distances, 0)), ids
+
     def nearest_neighbors(self, xq, k=8):
-        distances, neighbor_idx = self.query(xq, k=k, return_distance=True)
-        neighbor_idx = np.squeeze(neighbor_idx)
-        distances    = np.squeeze(distances)
-        keys = []
-        for nid in neighbor_idx:
-            nid = int(nid)
-            result = self.__db.get_id(nid)
-            _, key = result
-            keys.append(key)
+        """
+        Find the k nearest neighbors of one or many queries
+        args:
+            :xq (np.ndarray) - a (d,) query or (Q, d) queries
+            :k (int)         - neighbors per query
+        returns:
+            :(keys, distances), (Q, k) arrays or single (k,) rows for a (d,) query.
+             Distances are Euclidean, as in `search`. Keys are resolved in one bulk lookup and are None where the index
+             found fewer than k neighbors.
+        """
+        xq = np.asarray(xq)
+        single = xq.ndim == 1
+        distances, neighbor_idx = self.search(np.atleast_2d(xq), k=k)
+        neighbor_idx = np.asarray(neighbor_idx)
+
+        keys = np.empty(neighbor_idx.size, dtype=object)
+        keys[:] = self.__db.get_keys(neighbor_idx.ravel())
+        keys = keys.reshape(neighbor_idx.shape)
+        if single:
+            return keys[0], distances[0]
         return keys, distances
     
     @property
@@ -65,21 +168,34 @@ class KNNDatabase(object):
         self.db.close()
 
 
-def load_knn_db(database_path):
+def load_knn_db(database_path, backend=None):
     """
     Load indexed MemoryMappedDatabase
     args:
         :database_path (Path or str) - root of database 
+        :backend (str)               - 'kdtree', 'faiss' or 'brute'. By default the trained
+                                       index is used, or exact brute force search if there is none.
+                                       Every backend reports Euclidean distances.
     returns:
         :KNNDatabase
     """
     db = MemoryMappedDatasetReader(database_path)
     db.open()
 
-    index_file = list(Path(database_path).glob("trained*index"))[0] 
+    index_files = [index_file for index_file in sorted(Path(database_path).glob("trained*index"))
+                   if backend is None or backend in index_file.stem]
+    if backend == 'brute' or (backend is None and not index_files):
+        return KNNDatabase(db, BruteForceIndex(db))
+    if not index_files:
+        raise FileNotFoundError(f"No trained {backend} index in {database_path}")
+
+    index_file = index_files[0]
+    # backends are imported only once an index of their kind is loaded
     if "kdtree" in index_file.stem:
+        import joblib
         index = joblib.load(index_file)
     elif "faiss" in index_file.stem:
+        import faiss
         index = faiss.read_index(str(index_file))  
     else:
         raise ValueError(f"Cannot infer index type from {index_file}")
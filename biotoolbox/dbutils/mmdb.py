@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-#import mmap
+import os
 import csv
+import mmap
+import zlib
 import sqlite3
 import tempfile
 from enum import Enum
@@ -11,21 +13,44 @@ from pathlib import Path
 import numpy as np
 
 __all__ = ['MemoryMappedDatasetReader',
+           'ShardedArray',
            'TemporaryMemmap',
            'MemoryMappedDatasetWriter',
-           'OneToOneMap', 'save_shard']
+           'OneToOneMap', 'CompiledKeyIndex',
+           'compile_key_index', 'save_shard']
 
-def save_shard(array, outfile):
+STORAGE_DTYPES   = ('float32', 'float16', 'int8')
+QUANTIZE_ROWS    = 2**14 # rows quantized at a time when an int8 shard is saved
+
+def save_shard(array, outfile, dtype='float32'):
     """
     Writes an array to a numpy readable format and 
     returns the shape of the array to record into the keyfile
     """
     array = np.asarray(array)
-    ptr = np.memmap(outfile, dtype='float32', mode='w+', shape=array.shape)
+    ptr = np.memmap(outfile, dtype=dtype, mode='w+', shape=array.shape)
     ptr[:] = array[:]
     del ptr
     return array.shape
 
+def _scale_file(shardfile):
+    """Sidecar holding the (2, d) per-dimension scale and offset of an int8 shard"""
+    shardfile = Path(shardfile)
+    return shardfile.with_name(shardfile.name + '.scale.npy')
+
+def _int8_scales(array):
+    """Per-dimension (scale, offset) mapping the range of each column onto 256 levels"""
+    lo, hi = array.min(axis=0), array.max(axis=0)
+    scale  = (hi - lo) / 255
+    return np.stack([np.where(scale > 0, scale, 1), lo]).astype(np.float32)
+
+def _quantize_int8(array, scales):
+    codes = np.rint((array - scales[1]) / scales[0]) - 128
+    return np.clip(codes, -128, 127).astype(np.int8)
+
+def _dequantize_int8(codes, scales):
+    return (codes.astype(np.float32) + 128) * scales[0] + scales[1]
+
 def _create_connection(db_file):
     """
     Create connection to local SQLite database, given by db_file
@@ -56,6 +81,7 @@ class OneToOneMap(object):
         self.db    = str(db_file)
         self.__connection = None
         self.__read_only = read_only
+        self.__bulk = False
     
     @property
     def read_only(self):
@@ -89,6 +115,32 @@ class OneToOneMap(object):
             if commit:
                 self.commit()
 
+    def add_many(self, pairs, commit=False):
+        """
+        Append many relationships with one `executemany` per table
+        args:
+            :pairs (iterable) - (src, dst) tuples
+        """
+        if not self.read_only:
+            pairs = list(pairs)
+            c = self.__connection.cursor()
+            if not self.__connection.in_transaction:
+                c.execute("begin")
+            c.executemany("insert into forward (id, prot_id) values (?,?)", pairs)
+            c.executemany("insert into backward (prot_id, id) values (?,?)", [(dst, src) for src, dst in pairs])
+            if commit:
+                self.commit()
+
+    def bulk_load(self):
+        """
+        Tune the connection for a build: write-ahead logging and no fsync per
+        commit. `close` switches the journal back so the database is a single file.
+        """
+        c = self.__connection.cursor()
+        c.execute("pragma journal_mode=WAL")
+        c.execute("pragma synchronous=OFF")
+        self.__bulk = True
+
     def retrieve(self, id, direction="forward"):
         """Retrieves a relationship from underlying database"""
 
@@ -103,6 +155,28 @@ class OneToOneMap(object):
         one = c.fetchone()
         return one
 
+    def retrieve_many(self, ids, direction="forward", chunk_size=900):
+        """
+        Retrieves many relationships with one set-based query per `chunk_size` ids
+        (kept under SQLite's bound-parameter limit)
+        returns:
+            :dict mapping each found id to its row, missing ids are absent
+        """
+        if direction not in ['forward', 'backward']:
+            raise ValueError("Bad direction (not forward/backward)")
+        else:
+            key = "id" if direction == "forward" else "prot_id"
+
+        found = {}
+        ids = list(ids)
+        c = self.__connection.cursor()
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            query = f"select * from {direction} where {key} in ({','.join('?' * len(chunk))})"
+            for row in c.execute(query, chunk):
+                found[row[0]] = row
+        return found
+
     def open(self):
         CREATE_INDEX_TABLE = """CREATE TABLE IF NOT EXISTS forward (
                             id integer PRIMARY KEY,
@@ -123,14 +197,181 @@ class OneToOneMap(object):
     def close(self):
         if self.__connection is not None:
             self.__connection.commit()
+            if self.__bulk:
+                self.__connection.execute("pragma journal_mode=DELETE")
+                self.__bulk = False
             self.__connection.close()
             self.__connection = None
 
 
+def _key_hash(key):
+    """Stable across processes, unlike hash()"""
+    return zlib.crc32(key)
+
+def _hash_table(hashes):
+    """
+    Open addressing (linear probing) table of row ids, filled a probe round at a
+    time: every pending key claims its current slot, the first claimant of an
+    empty slot keeps it and the others move on to the next slot.
+    """
+    size = 1 << max(1, int(2 * len(hashes) - 1).bit_length()) # load factor <= 0.5
+    mask = size - 1
+    table   = np.full(size, -1, dtype=np.int64)
+    pending = np.arange(len(hashes), dtype=np.int64)
+    slots   = hashes.astype(np.int64) & mask
+    while len(pending):
+        empty = np.flatnonzero(table[slots] == -1)
+        claimed, first = np.unique(slots[empty], return_index=True)
+        table[claimed] = pending[empty[first]]
+        placed = np.zeros(len(pending), dtype=bool)
+        placed[empty[first]] = True
+        pending, slots = pending[~placed], (slots[~placed] + 1) & mask
+    return table
+
+def compile_key_index(path, fetch_size=2**16):
+    """
+    Compile the key database of a finished dataset into a CompiledKeyIndex:
+    the keys concatenated in row order (keys.blob), their uint64 byte offsets
+    (keys.offsets.npy) and a hash table of row ids (keys.table.npy).
+    Keys are streamed out of sqlite and only their hashes are held in memory.
+    args:
+        :path (Path or str) - dataset directory holding map.db
+    returns:
+        :number of keys compiled
+    """
+    path = Path(path)
+    files = {item.name: path / item.value for item in MemoryMappedDatasetComponents}
+    connection = _create_connection(files['keys'])
+    try:
+        N, = connection.execute("select count(*) from forward").fetchone()
+        offsets = np.lib.format.open_memmap(files['key_offsets'], mode='w+', dtype=np.uint64, shape=(N + 1,))
+        hashes  = np.empty(N, dtype=np.uint32)
+
+        position = 0
+        with open(files['key_blob'], 'wb') as blob:
+            c = connection.execute("select id, prot_id from forward order by id")
+            for rows in iter(lambda: c.fetchmany(fetch_size), []):
+                if rows[0][0] != position or rows[-1][0] != position + len(rows) - 1:
+                    raise ValueError(f"row ids of {files['keys']} are not contiguous from 0")
+                keys = [row[1].encode() for row in rows]
+                offsets[position + 1:position + 1 + len(keys)] = offsets[position] + np.cumsum([len(key) for key in keys])
+                hashes[position:position + len(keys)] = [_key_hash(key) for key in keys]
+                blob.write(b''.join(keys))
+                position += len(keys)
+        offsets.flush()
+    finally:
+        connection.close()
+    np.save(files['key_table'], _hash_table(hashes))
+    return N
+
+class CompiledKeyIndex(object):
+    """
+    Read-only replacement for OneToOneMap built by compile_key_index.
+    Everything is memory mapped: id -> key is an offset lookup and
+    key -> id a hash table probe, with no sqlite connection involved.
+    """
+    def __init__(self, path):
+        path = Path(path)
+        self.blob_file    = path / MemoryMappedDatasetComponents.key_blob.value
+        self.offsets_file = path / MemoryMappedDatasetComponents.key_offsets.value
+        self.table_file   = path / MemoryMappedDatasetComponents.key_table.value
+        self.__blob = None
+        self.offsets = None
+        self.table = None
+        self.__offsets = None # memoryviews, indexing them yields plain ints
+        self.__table = None
+
+    @classmethod
+    def exists(cls, path):
+        path = Path(path)
+        return all((path / item.value).exists() for item in (MemoryMappedDatasetComponents.key_blob,
+                                                            MemoryMappedDatasetComponents.key_offsets,
+                                                            MemoryMappedDatasetComponents.key_table))
+
+    @property
+    def read_only(self):
+        return True
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def open(self):
+        if self.__blob is None:
+            self.offsets = np.load(self.offsets_file, mmap_mode='r')
+            self.table   = np.load(self.table_file, mmap_mode='r')
+            with open(self.blob_file, 'rb') as blob:
+                # empty files cannot be mapped
+                self.__blob = mmap.mmap(blob.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b''
+            self.__offsets = memoryview(self.offsets)
+            self.__table   = memoryview(self.table)
+
+    def close(self):
+        if self.__blob is not None:
+            if isinstance(self.__blob, mmap.mmap):
+                self.__blob.close()
+            self.__blob = None
+            self.__offsets = None
+            self.__table = None
+            self.offsets = None
+            self.table = None
+
+    def commit(self):
+        pass
+
+    def key_bytes(self, id):
+        return self.__blob[self.__offsets[id]:self.__offsets[id + 1]]
+
+    def keys(self):
+        """Yields all of the text keys in row order, as 1-tuples like OneToOneMap.keys"""
+        for id in range(len(self)):
+            yield (self.key_bytes(id).decode(),)
+
+    def _find(self, key):
+        """Probe the hash table, returns the row id or None"""
+        target = key.encode()
+        mask = len(self.__table) - 1
+        slot = _key_hash(target) & mask
+        while True:
+            id = self.__table[slot]
+            if id < 0:
+                return None
+            if self.key_bytes(id) == target:
+                return id
+            slot = (slot + 1) & mask
+
+    def retrieve(self, id, direction="forward"):
+        """Retrieves a relationship, returning the same rows as OneToOneMap.retrieve"""
+        if direction not in ['forward', 'backward']:
+            raise ValueError("Bad direction (not forward/backward)")
+        if direction == 'forward':
+            if not 0 <= id < len(self):
+                return None
+            return (id, self.key_bytes(id).decode())
+        found = self._find(id)
+        return None if found is None else (id, found)
+
+    def retrieve_many(self, ids, direction="forward"):
+        """
+        Retrieves many relationships
+        returns:
+            :dict mapping each found id to its row, missing ids are absent
+        """
+        if direction not in ['forward', 'backward']:
+            raise ValueError("Bad direction (not forward/backward)")
+        found = {}
+        for id in ids:
+            row = self.retrieve(id, direction=direction)
+            if row is not None:
+                found[row[0]] = row
+        return found
+
 class MemoryMappedDatasetComponents(Enum):
-    keys     = Path("map.db")
-    shards   = Path("shards")
-    metadata = Path("metadata.tsv")
+    keys        = Path("map.db")
+    shards      = Path("shards")
+    metadata    = Path("metadata.tsv")
+    key_blob    = Path("keys.blob")
+    key_offsets = Path("keys.offsets.npy")
+    key_table   = Path("keys.table.npy")
 
 class MemoryMappedDatasetWriter(object):
     """
@@ -145,6 +386,8 @@ class MemoryMappedDatasetWriter(object):
     def __init__(self, path,
                  embedding_dim=512,
                  shard_size=2**17,
+                 dtype='float32',
+                 compile_keys=False,
                  start=False):
         """
         Initialize a dataset writer that will write to `path`.
@@ -152,10 +395,18 @@ class MemoryMappedDatasetWriter(object):
             :path (Path or str)  - Path to 'dataset'
             :embedding_dim (int) - Dimensionality of feature vectors
             :shard_size (int)    - Number of records per 'shard'
+            :dtype (str)         - storage type, one of STORAGE_DTYPES. float16 halves the
+                                   size (values beyond +-65504 overflow), int8 quarters it
+                                   with a per-shard, per-dimension scale and offset
+            :compile_keys (bool) - compile a CompiledKeyIndex when the dataset is closed
         """
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported storage dtype {dtype} (not in {STORAGE_DTYPES})")
         self.path = Path(path)
         self._n = shard_size
         self._d = embedding_dim 
+        self._dtype = np.dtype(dtype)
+        self._compile_keys = compile_keys
 
         self._s = 0 # shard count
         self._t = 0 # num. lines
@@ -175,37 +426,74 @@ class MemoryMappedDatasetWriter(object):
             self.path.mkdir(exist_ok=True, parents=True)
             self.shards.mkdir(exist_ok=True, parents=True)
             self.keydb.open()
+            self.keydb.bulk_load()
+            for item in (self.key_blob, self.key_offsets, self.key_table):
+                item.unlink(missing_ok=True) # stale once the dataset is rewritten
 
             self._shard_md_pointer = open(self.metadata, 'w')
             self._shard_md_writer  = csv.DictWriter(self._shard_md_pointer, delimiter='\t',
-                                                    fieldnames=["shard", "shard_id", "n", "d"])
+                                                    fieldnames=["shard", "shard_id", "n", "d", "dtype"])
             self._shard_md_writer.writeheader()
 
             self._reset_shard()
             self.__open = True
 
+    @property
+    def quantized(self):
+        return self._dtype == np.int8
+
     def _reset_shard(self):
-        self._shard = np.zeros((self._n, self._d))
+        """
+        Start the next shard. Rows are written straight to a memmap of the shard file,
+        or for int8 storage to a float32 staging memmap quantized when the shard is saved.
+        """
+        if self.quantized:
+            self._shard = TemporaryMemmap(dtype='float32', shape=(self._n, self._d))
+        else:
+            self._shard = np.memmap(self.shards / self.shardfilename, dtype=self._dtype, mode='w+',
+                                    shape=(self._n, self._d))
 
     def close(self):
-        """Close the dataset"""
+        """Close the dataset, trimming the last shard down to the rows it holds"""
         if self.__open:
-            self._save_shard()
-            self._record()
+            n = self._t - self._s * self._n
+            shardfile = self.shards / self.shardfilename
+            if n:
+                self._save_shard(n)
+            self._shard = None
+            if not n:
+                shardfile.unlink(missing_ok=True) # empty dataset, no rows to map
+            elif not self.quantized:
+                os.truncate(shardfile, n * self._d * self._dtype.itemsize)
+            self._record(n)
             self.keydb.close()
+            if self._compile_keys:
+                compile_key_index(self.path)
             self._shard_md_pointer.close()
             self.__open = False
             self._shard = None
 
-    def _save_shard(self):
+    def _save_shard(self, n=None):
         """
-        Save a shard by generating its filename and writing it to a np.memmap pointer.
+        Save the first `n` rows of a shard by flushing its np.memmap to disk. Staged
+        int8 shards are quantized block by block and their scales saved alongside.
         """
-        shardfile = self.shardfilename
-        save_shard(self._shard, self.shardfilename)
-
-    def _record(self):
-        row = dict(shard=self.shardfilename, shard_id=self._s, n=self._n, d=self._d)
+        if not self.quantized:
+            self._shard.flush()
+            return
+
+        staged = self._shard[:self._n if n is None else n]
+        scales = _int8_scales(staged)
+        shardfile = self.shards / self.shardfilename
+        codes = np.memmap(shardfile, dtype=np.int8, mode='w+', shape=staged.shape)
+        for start in range(0, len(staged), QUANTIZE_ROWS):
+            codes[start:start + QUANTIZE_ROWS] = _quantize_int8(staged[start:start + QUANTIZE_ROWS], scales)
+        codes.flush()
+        np.save(_scale_file(shardfile), scales)
+
+    def _record(self, n=None):
+        n = self._n if n is None else n
+        row = dict(shard=self.shardfilename, shard_id=self._s, n=n, d=self._d, dtype=self._dtype.name)
         self._shard_md_writer.writerow(row)
         self._s += 1
 
@@ -219,12 +507,7 @@ class MemoryMappedDatasetWriter(object):
         if self.__open:
             # if the shard is complete (nonzero t, reached shard capacity)
             # then record the shard and reset
-            if self._t and not self._t % self._n:
-                self._save_shard()
-                self._record()
-                self._reset_shard()
-                self.keydb.commit()
-                reset_shard = True
+            reset_shard = self._roll_shard()
 
             self._shard[self._t % self._n] = value 
             # add key
@@ -232,6 +515,49 @@ class MemoryMappedDatasetWriter(object):
             self._t += 1 
         return reset_shard
 
+    def set_many(self, keys, matrix, commit=False):
+        """
+        Append a block of items to the database. Rows are copied into the shard
+        buffer in slices split at shard boundaries and each slice's keys are
+        inserted with one batched statement.
+        args:
+            :keys (sequence)      - n keys
+            :matrix (np.ndarray)  - (n, embedding_dim) vectors
+        returns:
+            :True if a shard was completed along the way
+        """
+        reset_shard = False
+        if self.__open:
+            keys   = list(keys)
+            matrix = np.asarray(matrix)
+            if matrix.shape != (len(keys), self._d):
+                raise ValueError(f"expected a ({len(keys)}, {self._d}) matrix, got {matrix.shape}")
+
+            written = 0
+            while written < len(keys):
+                reset_shard |= self._roll_shard()
+                offset = self._t % self._n
+                block  = min(self._n - offset, len(keys) - written)
+                self._shard[offset:offset + block] = matrix[written:written + block]
+                self.keydb.add_many(zip(range(self._t, self._t + block), keys[written:written + block]))
+                self._t += block
+                written += block
+            if commit:
+                self.keydb.commit()
+        return reset_shard
+
+    def _roll_shard(self):
+        """Record the current shard and start a new one if it is full"""
+        # if the shard is complete (nonzero t, reached shard capacity)
+        # then record the shard and reset
+        if self._t and not self._t % self._n:
+            self._save_shard()
+            self._record()
+            self._reset_shard()
+            self.keydb.commit()
+            return True
+        return False
+
 
 class MemoryMappedDatasetReader(object):
     """
@@ -250,7 +576,10 @@ class MemoryMappedDatasetReader(object):
             setattr(self, item.name, self.path / item.value) 
 
         self.__validate()
-        self.keydb = OneToOneMap(self.keys, read_only=True) 
+        if CompiledKeyIndex.exists(self.path):
+            self.keydb = CompiledKeyIndex(self.path)
+        else:
+            self.keydb = OneToOneMap(self.keys, read_only=True) 
         self.__open = False
         self.__embedding_matrix = None
         self.__shape = None
@@ -284,17 +613,21 @@ class MemoryMappedDatasetReader(object):
                     N += int(row['n'])
                     shard_md.append(row)
 
-            d = int(shard_md[0]['d'])
+            d = int(shard_md[0]['d']) if shard_md else 0
             self.__shape = (N, d)
-            offset = 0
-            self.__embedding_matrix = TemporaryMemmap(shape=self.__shape, dtype=np.float32)
+            scales = []
             for row in shard_md:
                 n, d = map(int, (row['n'], row['d']))
+                dtype = row.get('dtype') or 'float32' # datasets written before quantization
                 spath = self.shards / Path(row['shard']).name
-                mmarr = np.memmap(spath, mode='r+', shape=(n,d), dtype='float32')
-                self.__embedding_matrix[offset:offset+n,...] = mmarr
+                if n == 0:
+                    mmarr = np.zeros((0, d), dtype=dtype) # empty files cannot be mapped
+                else:
+                    mmarr = np.memmap(spath, mode='r', shape=(n,d), dtype=dtype)
                 self.__members.append(mmarr)
-                offset += n
+                scales.append(np.load(_scale_file(spath)) if dtype == 'int8' and n else None)
+            self.__embedding_matrix = ShardedArray(self.__members, d, scales=scales)
+            self.__open = True
 
     def close(self):
         if self.__open:
@@ -311,7 +644,7 @@ class MemoryMappedDatasetReader(object):
         return self.__embedding_matrix
 
     def get(self, key):
-        """Retrieve embedding for the input key"""
+        """Retrieve embedding for the input key, as a copy that can be modified freely"""
         
         result = self.get_id(key)
         direction = self.get_direction(key)
@@ -322,10 +655,59 @@ class MemoryMappedDatasetReader(object):
         vector_id = result[0] if direction == 'forward' else result[1]
         return self.__embedding_matrix[vector_id]
 
+    def get_many(self, keys, strict=True):
+        """
+        Retrieve the embeddings of many keys at once. Keys are resolved with
+        set-based queries and rows are gathered shard by shard.
+        args:
+            :keys (iterable of str or of int) - protein ids or row ids (Python or NumPy
+                                                integers, e.g. an index array), not mixed
+            :strict (bool)                    - raise if any key is missing
+        returns:
+            :strict=True  - the (B, d) array in the order of `keys`
+            :strict=False - always a tuple: ((B, d) array with NaN rows for missing keys,
+                            list of missing keys, empty if none are)
+        """
+        keys = list(keys)
+        directions = {self.get_direction(key) for key in keys}
+        if len(directions) > 1:
+            raise TypeError("keys mix str and int")
+
+        if directions == {'forward'}:
+            rows  = np.asarray(keys, dtype=np.int64)
+            found = (rows >= 0) & (rows < len(self))
+        else:
+            resolved = self.keydb.retrieve_many(keys, direction='backward')
+            rows  = np.array([resolved[key][1] if key in resolved else -1 for key in keys], dtype=np.int64)
+            found = rows >= 0
+
+        missing = [key for key, ok in zip(keys, found) if not ok]
+        if strict and missing:
+            raise ValueError(f"{len(missing)} keys not found: {missing[:10]}{' ...' if len(missing) > 10 else ''}")
+
+        if not missing:
+            matrix = self.__embedding_matrix.take(rows)
+            return matrix if strict else (matrix, missing)
+        matrix = np.full((len(keys), self.shape[1]), np.nan, dtype=np.float32)
+        matrix[found] = self.__embedding_matrix.take(rows[found])
+        return matrix, missing
+
+    def get_keys(self, ids):
+        """
+        Resolve row ids to protein ids with one bulk lookup
+        args:
+            :ids (iterable of int) - row ids, out of range ids (e.g. faiss's -1 padding) are allowed
+        returns:
+            :list of keys, None where an id is not in the dataset
+        """
+        ids = [int(id) for id in ids]
+        found = self.keydb.retrieve_many(set(ids), direction='forward')
+        return [found[id][1] if id in found else None for id in ids]
+
     def get_direction(self, key):
         if isinstance(key, str):
             direction = 'backward'
-        elif isinstance(key, int):
+        elif isinstance(key, (int, np.integer)):
             direction = 'forward'
         else:
             raise TypeError(f"{type(key)} is not in [str,int]")
@@ -334,6 +716,8 @@ class MemoryMappedDatasetReader(object):
 
     def get_id(self, key):
         direction = self.get_direction(key) 
+        if direction == 'forward':
+            key = int(key) # sqlite cannot bind NumPy integers
         result = self.keydb.retrieve(key, direction=direction)
         if result is None:
             raise ValueError(f"{key} not found")
@@ -347,6 +731,108 @@ class MemoryMappedDatasetReader(object):
         """Yields all of the protein ids in the dataset"""
         yield from self.keydb.keys()
 
+class ShardedArray(object):
+    """
+    Read-only virtual concatenation of row shards (e.g. read-only np.memmaps).
+    Global row indices are translated into (shard, offset) lookups, so nothing
+    is copied until rows are actually requested. Reduced precision shards are
+    decoded to float32 as rows are read.
+    Rows handed out by indexing, `take` and iteration are writable copies that
+    do not alias the shards; only `blocks` yields (read-only) views of them.
+    """
+    def __init__(self, shards, d, scales=None):
+        """
+        args:
+            :shards (list of np.ndarray) - (n_i, d) arrays, in row order
+            :d (int)                     - row dimensionality
+            :scales (list)               - per shard, None or the (2, d) scale and offset
+                                           of an int8 quantized shard
+        """
+        self.shards  = list(shards)
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+        self.scales  = list(scales) if scales is not None else [None] * len(self.shards)
+        self.d = d
+
+    @property
+    def shape(self):
+        return (int(self.offsets[-1]), self.d)
+
+    @property
+    def dtype(self):
+        """Type of the rows handed out, float32 unless the shards are wider"""
+        if not self.shards or self.scales[0] is not None:
+            return np.dtype('float32')
+        return np.result_type(self.shards[0].dtype, np.float32)
+
+    def _decode(self, s, rows, copy=False):
+        if self.scales[s] is not None:
+            return _dequantize_int8(rows, self.scales[s])
+        return rows.astype(self.dtype, copy=copy)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def locate(self, rows):
+        """Translate global row indices into (shard ids, rows within shard)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = np.where(rows < 0, rows + len(self), rows)
+        if rows.size and (rows.min() < 0 or rows.max() >= len(self)):
+            raise IndexError(f"row index out of range for {len(self)} rows")
+        shard = np.searchsorted(self.offsets, rows, side='right') - 1
+        return shard, rows - self.offsets[shard]
+
+    def take(self, rows):
+        """
+        Gather rows into one contiguous (len(rows), d) array. Rows are grouped
+        by shard and read in sorted order within each shard.
+        """
+        rows = np.asarray(rows, dtype=np.int64).ravel()
+        out  = np.empty((len(rows), self.d), dtype=self.dtype)
+        shard, local = self.locate(rows)
+        order = np.lexsort((local, shard))
+        bounds = np.searchsorted(shard[order], np.arange(len(self.shards) + 1))
+        for s, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if start < stop:
+                selected = order[start:stop]
+                out[selected] = self._decode(s, self.shards[s][local[selected]])
+        return out
+
+    def blocks(self, block_rows, shard=None):
+        """
+        Yields (global row offset, decoded block) pairs of at most `block_rows` rows,
+        over every shard or just `shard`. Blocks never straddle shards, and float32
+        blocks are read-only views of the shard rather than copies.
+        """
+        for s in (range(len(self.shards)) if shard is None else [shard]):
+            for start in range(0, len(self.shards[s]), block_rows):
+                block = self.shards[s][start:start + block_rows]
+                yield int(self.offsets[s]) + start, self._decode(s, block)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, cols = key[0], key[1:]
+            if isinstance(rows, (int, np.integer)):
+                return self[rows][cols]
+            return self[rows][(slice(None),) + cols]
+        if isinstance(key, (int, np.integer)):
+            shard, local = self.locate(key)
+            return self._decode(int(shard), self.shards[int(shard)][int(local)], copy=True)
+        if isinstance(key, slice):
+            return self.take(np.arange(*key.indices(len(self))))
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.flatnonzero(key)
+        return self.take(key)
+
+    def __iter__(self):
+        for s, shard in enumerate(self.shards):
+            for row in shard:
+                yield self._decode(s, row, copy=True)
+
+    def __array__(self, dtype=None, copy=None):
+        out = self.take(np.arange(len(self)))
+        return out if dtype is None else out.astype(dtype)
+
 class TemporaryMemmap(np.memmap):
     """
     Extension of numpy memmap to automatically map to a file stored in temporary directory.
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# fasta_index.py
+
+"""
+Random access to the records of a plain or BGZF compressed FASTA file
+through a samtools-style `.fai` sidecar index: one line per record holding its name, sequence length,
+byte offset of the first residue, residues per line and bytes per line.
+"""
+
+import os
+import mmap
+import collections
+
+from .gen import FASTA_CHUNK_SIZE, is_gzipped, _binary_handle, _offset_blocks, _record_spans
+from .bgzf import is_bgzf, BgzfReader
+
+__all__ = ['FastaIndexEntry', 'build_fasta_index', 'read_fasta_index', 'write_fasta_index', 'IndexedFasta']
+
+FastaIndexEntry = collections.namedtuple('FastaIndexEntry', ['name', 'length', 'offset', 'linebases', 'linewidth'])
+
+def _index_path(fasta):
+    return f"{os.fspath(fasta)}.fai"
+
+def _index_record(record, start):
+    """Index entry of a record starting at byte `start` of the file"""
+    newline = record.find(b'\n')
+    words   = record[1:newline if newline >= 0 else len(record)].split(None, 1)
+    name    = words[0].decode() if words else ''
+    if newline < 0:
+        return FastaIndexEntry(name, 0, start + len(record), 0, 0)
+
+    offset = start + newline + 1
+    body   = record[newline + 1:]
+    if not body:
+        return FastaIndexEntry(name, 0, offset, 0, 0)
+    if not body.endswith(b'\n'):
+        body += b'\n' # last record of a file without a final newline
+
+    linewidth = body.find(b'\n') + 1
+    linebases = linewidth - 1 - body.startswith(b'\r', linewidth - 2)
+    lines = body.count(b'\n')
+    # every line but the last must end at a multiple of the line width
+    full  = (lines - 1) * linewidth
+    last  = body[full:-1].rstrip(b'\r')
+    if body[linewidth - 1:full:linewidth] != b'\n' * (lines - 1) or len(last) > linebases:
+        raise ValueError(f"Record {name} has lines of different lengths, it cannot be indexed")
+    return FastaIndexEntry(name, linebases * (lines - 1) + len(last), offset, linebases, linewidth)
+
+def _records(handle, chunk_size=FASTA_CHUNK_SIZE):
+    """
+    Reads a binary stream in blocks of whole records like gen.fasta_blocks,
+    keeping track of where each record starts in the uncompressed data
+    yields:
+        :(offset, record bytes) pairs
+    """
+    for offset, block in _offset_blocks(handle, chunk_size):
+        for start, _, end in _record_spans(block):
+            yield offset + start, block[start:end]
+
+def build_fasta_index(fasta, threads=None):
+    """
+    Index every record of a plain or BGZF compressed FASTA file in one pass.
+    Offsets are positions in the uncompressed data, as in samtools faidx.
+    args:
+        :fasta (str or Path) - FASTA file
+        :threads (int)       - threads inflating BGZF input, defaults to the number of CPUs
+    returns:
+        :list of FastaIndexEntry in file order
+    """
+    if is_gzipped(fasta) and not is_bgzf(fasta):
+        raise ValueError(f"{fasta} is gzip compressed, only BGZF files can be indexed (see bgzf.bgzip)")
+    with _binary_handle(fasta, threads) as handle:
+        entries = [_index_record(record, start) for start, record in _records(handle)]
+    _check_unique(entries)
+    return entries
+
+def _check_unique(entries):
+    """Records are looked up by name, so every name must occur once"""
+    names = collections.Counter(entry.name for entry in entries)
+    duplicated = [name for name, count in names.items() if count > 1]
+    if duplicated:
+        raise ValueError(f"{len(duplicated)} record names occur more than once, e.g. {duplicated[:5]}")
+
+def write_fasta_index(entries, index_path):
+    with open(index_path, 'w') as handle:
+        for entry in entries:
+            handle.write('\t'.join(map(str, entry)) + '\n')
+
+def read_fasta_index(index_path):
+    """Read a .fai file into a list of FastaIndexEntry"""
+    entries = []
+    with open(index_path, 'r') as handle:
+        for line in handle:
+            name, length, offset, linebases, linewidth = line.rstrip('\n').split('\t')[:5]
+            entries.append(FastaIndexEntry(name, int(length), int(offset), int(linebases), int(linewidth)))
+    return entries
+
+class IndexedFasta(object):
+    """
+    Random access to the records of a FASTA file. The file is memory mapped and
+    the `.fai` index (built on first use) locates any record or subsequence
+    directly, so only the bytes asked for are read. BGZF files are read through
+    their `.gzi` block index, inflating only the blocks holding those bytes.
+    """
+    def __init__(self, fasta, index_path=None, cache_blocks=64, start=True):
+        """
+        args:
+            :fasta (str or Path)      - plain or BGZF compressed FASTA file
+            :index_path (str or Path) - index file, defaults to `<fasta>.fai`
+            :cache_blocks (int)       - BGZF only, inflated blocks kept in memory
+        """
+        self.fasta = fasta
+        self.index_path = index_path or _index_path(fasta)
+        self.cache_blocks = cache_blocks
+        self.entries = {}
+        self.__handle = None
+        self.__data = None
+        if start:
+            self.open()
+
+    def open(self):
+        if self.__data is None:
+            if os.path.exists(self.index_path):
+                entries = read_fasta_index(self.index_path)
+                _check_unique(entries)
+            else:
+                entries = build_fasta_index(self.fasta)
+                write_fasta_index(entries, self.index_path)
+            self.entries = {entry.name: entry for entry in entries}
+            if is_bgzf(self.fasta):
+                # sliced by uncompressed offsets like the map, inflating only the blocks needed
+                self.__data = BgzfReader(self.fasta, cache_blocks=self.cache_blocks)
+                if not os.path.exists(self.__data.gzi_path):
+                    self.__data.write_index()
+                return
+            self.__handle = open(self.fasta, 'rb')
+            size = os.fstat(self.__handle.fileno()).st_size
+            # empty files cannot be mapped
+            self.__data = mmap.mmap(self.__handle.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def close(self):
+        if self.__data is not None:
+            if not isinstance(self.__data, bytes):
+                self.__data.close()
+            if self.__handle is not None:
+                self.__handle.close()
+            self.__data = None
+            self.__handle = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def _position(self, entry, position):
+        """File offset of residue `position` of a record"""
+        if entry.linebases == 0:
+            return entry.offset
+        line, column = divmod(position, entry.linebases)
+        return entry.offset + line * entry.linewidth + column
+
+    def subsequence(self, name, start=0, end=None):
+        """
+        Residues [start, end) of a record, 0-based like Python slices
+        args:
+            :name (str)  - record name, the first word of its header
+            :start (int) - first residue
+            :end (int)   - one past the last residue, defaults to the end of the record
+        returns:
+            :str
+        """
+        entry = self.entries[name]
+        start, end, _ = slice(start, end).indices(entry.length)
+        if end <= start:
+            return ''
+        chunk = self.__data[self._position(entry, start):self._position(entry, end)]
+        return chunk.translate(None, b'\r\n').decode()
+
+    def fetch(self, name):
+        """Whole sequence of a record, as stored (stop codons are kept)"""
+        return self.subsequence(name)
+
+    def __getitem__(self, name):
+        return self.fetch(name)
+
+    def fetch_many(self, names):
+        """
+        Fetch many records, reading them in file order so the reads stay sequential
+        returns:
+            :list of sequences in the order of `names`
+        """
+        names = list(names)
+        missing = [name for name in names if name not in self.entries]
+        if missing:
+            raise KeyError(f"{len(missing)} records not in {self.fasta}: {missing[:10]}")
+        order = sorted(range(len(names)), key=lambda i: self.entries[names[i]].offset)
+        sequences = [None] * len(names)
+        for i in order:
+            sequences[i] = self.fetch(names[i])
+        return sequences
+
+if __name__ == '__main__':
+    pass
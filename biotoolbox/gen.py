@@ -1,36 +1,246 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-def fasta_reader(handle, width=None):
+FASTA_CHUNK_SIZE = 2**22          # bytes read at a time
+FASTA_WHITESPACE = b' \t\r\n\v\f'
+FASTA_STOP_CODON = '*'
+
+def is_gzipped(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+def _binary_handle(handle, threads=None):
+    """
+    Binary file object for a path (BGZF, gzip or plain) or an open text or binary handle.
+    BGZF blocks are inflated on `threads` threads (the number of CPUs by default).
+    """
+    import io, gzip
+    from .bgzf import is_bgzf, BgzfReader
+
+    if isinstance(handle, (str, bytes)) or hasattr(handle, '__fspath__'):
+        if not is_gzipped(handle):
+            return open(handle, 'rb')
+        if is_bgzf(handle):
+            return BgzfReader(handle).stream(threads, closing=True)
+        return gzip.open(handle, 'rb')
+    if isinstance(handle, io.TextIOBase):
+        if hasattr(handle, 'buffer'):
+            return handle.buffer
+        return io.BytesIO(handle.read().encode()) # in-memory text, e.g. io.StringIO
+    return handle
+
+def _random_access(path):
+    """Object sliced by (uncompressed) byte offsets over a plain or BGZF file: an mmap or a BgzfReader"""
+    import os, mmap
+    from .bgzf import is_bgzf, BgzfReader
+
+    if is_gzipped(path):
+        if not is_bgzf(path):
+            raise ValueError(f"{path} is gzip compressed, byte ranges need a plain or BGZF file")
+        return BgzfReader(path)
+    with open(path, 'rb') as handle:
+        # the map holds its own descriptor, empty files cannot be mapped
+        return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(handle.fileno()).st_size else b''
+
+def _next_record(data, position, window=2**16):
+    """Offset of the first record starting at or after `position`, or the data size if there is none"""
+    size = len(data)
+    while position < size:
+        start = max(position - 1, 0) # a newline just before `position` counts
+        found = data[start:position + window].find(b'\n>')
+        if found >= 0:
+            return start + found + 1
+        position += window
+    return size
+
+def fasta_byte_ranges(path, n):
+    """
+    Splits a plain or BGZF FASTA file into contiguous byte ranges of about equal size
+    that begin at a record boundary, to be read independently with
+    `fasta_reader(path, byte_range=...)`. Offsets are in the uncompressed data.
+    args:
+        :path (str or Path) - FASTA file
+        :n (int)            - number of ranges wanted, fewer are returned if records are too few
+    returns:
+        :list of (start, stop) tuples covering the whole file
+    """
+    data = _random_access(path)
+    try:
+        size, bounds = len(data), [0]
+        for k in range(1, n):
+            start = _next_record(data, max(size * k // n, bounds[-1] + 1))
+            if start >= size:
+                break
+            bounds.append(start)
+        bounds.append(size)
+    finally:
+        if hasattr(data, 'close'):
+            data.close()
+    return list(zip(bounds[:-1], bounds[1:]))
+
+class _RangeHandle(object):
+    """Binary file object reading bytes [start, stop) of a sliceable object, see _random_access"""
+    def __init__(self, data, start, stop):
+        self.data = data
+        self.position = start
+        self.stop = min(stop, len(data))
+        self.closed = False
+
+    def read(self, size=-1):
+        stop = self.stop if size is None or size < 0 else min(self.stop, self.position + size)
+        chunk = self.data[self.position:stop] if stop > self.position else b''
+        self.position = max(stop, self.position)
+        return chunk
+
+    def close(self):
+        if not self.closed and hasattr(self.data, 'close'):
+            self.data.close()
+        self.closed = True
+
+def _offset_blocks(handle, chunk_size=FASTA_CHUNK_SIZE):
+    """
+    Reads a binary stream `chunk_size` bytes at a time and yields blocks of whole records
+    with the offset of each block in the stream. Anything before the first record is skipped.
+    Only the new chunk (and the byte read before it) is searched for record starts, and the
+    pieces of a record spanning many chunks are joined once, when the record is complete,
+    so long records cost linear time.
+    yields:
+        :(offset, bytes holding one or more complete records, starting with '>') pairs
+    """
+    pending, start = [], None  # pieces of the unfinished record and the offset of the first one
+    position, previous = 0, b'\n' # bytes read so far and the last of them
+    while True:
+        chunk = handle.read(chunk_size)
+        if not chunk:
+            if pending:
+                yield start, b''.join(pending)
+            return
+        # a record starts at a '>' after a newline. '>' is rare, and single byte searches are
+        # much faster than searching for b'\n>'
+        first = chunk.find(b'>')
+        while first >= 0 and (chunk[first - 1:first] if first else previous) != b'\n':
+            first = chunk.find(b'>', first + 1)
+        if first < 0: # no record starts in this chunk
+            if pending:
+                pending.append(chunk)
+        else:
+            # records before the last record start in the chunk are complete
+            last = chunk.rfind(b'>')
+            while last > first and chunk[last - 1] != 0x0a:
+                last = chunk.rfind(b'>', first, last)
+            if pending:
+                block, offset = b''.join(pending + [chunk[:last]]), start
+            else:
+                block, offset = chunk[first:last], position + first
+            if block:
+                yield offset, block
+            pending, start = [chunk[last:]], position + last
+        previous = chunk[-1:]
+        position += len(chunk)
+
+def fasta_blocks(handle, chunk_size=FASTA_CHUNK_SIZE):
+    """
+    Reads a FASTA file `chunk_size` bytes at a time and yields blocks of whole records,
+    so that records can be delimited with bytes-level searches instead of per-line work.
+    A record running past the end of a chunk is carried over to the next block.
+    args:
+        :handle (binary file object) - fasta to read from
+        :chunk_size (int)            - bytes read at a time
+    yields:
+        :bytes holding one or more complete records, starting with '>'
+    """
+    for _, block in _offset_blocks(handle, chunk_size):
+        yield block
+
+def _record_spans(block):
+    """
+    (start, end of header line, end) offsets of the records in a block of whole records.
+    Records start at a '>' after a newline, found with single byte searches.
+    """
+    find, size = block.find, len(block)
+    start = 0
+    while start < size:
+        newline = find(b'\n', start)
+        newline = size if newline < 0 else newline
+        end = find(b'>', newline)
+        while end >= 0 and block[end - 1] != 0x0a:
+            end = find(b'>', end + 1)
+        end = size if end < 0 else end
+        yield start, newline, end
+        start = end
+
+def _raw_records(block):
+    """(header, sequence) memoryviews of the records in a block, see fasta_reader"""
+    whitespace = frozenset(FASTA_WHITESPACE)
+    trailing   = frozenset(FASTA_WHITESPACE + b'*') # and stop codons
+    view, find = memoryview(block), block.find
+    for start, newline, end in _record_spans(block):
+        if find(b'\n', newline + 1, end - 1) < 0:
+            # single line, the sequence lies in the block as is
+            stop = end
+            while stop > newline + 1 and block[stop - 1] in trailing:
+                stop -= 1
+            seq = view[newline + 1:stop]
+        else:
+            seq = memoryview(block[newline + 1:end].translate(None, FASTA_WHITESPACE).rstrip(b'*'))
+        stop = newline
+        while stop > start and block[stop - 1] in whitespace:
+            stop -= 1
+        yield view[start:stop], seq
+
+def _str_records(block, width=None):
+    """(header, sequence) str of the records in a block, see fasta_reader"""
+    import textwrap
+
+    view = memoryview(block)
+    for start, newline, end in _record_spans(block):
+        # decoded straight from the block, so a record is copied once
+        stop = end - (end > newline + 1 and block[end - 1] == 0x0a)
+        seq = str(view[newline + 1:stop], 'utf-8').replace('\n', '') # no copy for single-line records
+        if '\r' in seq:
+            seq = seq.replace('\r', '')
+        if ' ' in seq or '\t' in seq: # stray whitespace
+            seq = ''.join(seq.split())
+        seq = seq.rstrip(FASTA_STOP_CODON)
+        if width is not None:
+            seq = textwrap.fill(seq, width)
+        yield str(view[start:newline], 'utf-8').rstrip(), seq
+
+def fasta_reader(handle, width=None, raw=False, chunk_size=FASTA_CHUNK_SIZE, threads=None, byte_range=None):
     """
     Reads a FASTA file, yielding header, sequence pairs for each sequence recovered
     args:
-        :handle (str, pathliob.Path, or file pointer) - fasta to read from
+        :handle (str, pathliob.Path, or file pointer) - fasta to read from, gzip and BGZF files
+                                                       are recognized by their magic bytes
         :width (int or None) - formats the sequence to have max `width` character per line.
                                If <= 0, processed as None. If None, there is no max width.
+        :raw (bool)          - yield memoryviews of the undecoded bytes instead of str.
+                               Headers and single-line sequences are views of the block
+                               read (no copy), wrapped sequences get their line breaks
+                               removed first. `width` does not apply.
+        :chunk_size (int)    - bytes read at a time
+        :threads (int)       - threads inflating BGZF input, defaults to the number of CPUs
+        :byte_range (tuple)  - (start, stop) offsets from `fasta_byte_ranges`, read only the records
+                               in that range of a plain or BGZF file. `handle` must be a path.
     yields:
         :(header, sequence) tuples
     returns:
         :None
     """
-    FASTA_STOP_CODON = "*"
-    import io, textwrap, itertools
-
-    handle = handle if isinstance(handle, io.TextIOWrapper) else open(handle, 'r')
+    source = handle # a text handle closes its buffer when collected, keep it referenced
+    if byte_range is not None:
+        handle = _RangeHandle(_random_access(source), *byte_range)
+    else:
+        handle = _binary_handle(source, threads)
     width  = width if isinstance(width, int) and width > 0 else None
     try:
-        for is_header, group in itertools.groupby(handle, lambda line: line.startswith(">")):
-            if is_header:
-                header = group.__next__().strip()
-            else:
-                seq    = ''.join(line.strip() for line in group).strip().rstrip(FASTA_STOP_CODON)
-                if width is not None:
-                    seq = textwrap.fill(seq, width)
-                yield header, seq
+        records = _raw_records if raw else lambda block: _str_records(block, width)
+        for block in fasta_blocks(handle, chunk_size):
+            yield from records(block)
     finally:
-        if not handle.closed:
-            handle.close()
+        for opened in (handle, source):
+            if hasattr(opened, 'closed') and not opened.closed:
+                opened.close()
 
 if __name__ == '__main__':
     pass
-
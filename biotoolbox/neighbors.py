@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# neighbors.py
+
+"""
+Fixed-radius neighbor search over coordinates, so that contacts under
+a cutoff can be found without materializing an N x N distance matrix.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+__all__ = ['radius_pairs']
+
+def radius_pairs(coords, cutoff, mask=None):
+    """
+    Find all pairs of points within `cutoff` of each other with a KD-tree
+    args:
+        :coords (np.ndarray) - (N, 3) coordinates
+        :cutoff (float)      - inclusive distance cutoff
+        :mask (np.ndarray)   - optional (N,) boolean mask of the points to consider
+    returns:
+        :(i, j, distances) with i < j indexing into `coords`
+    """
+    coords = np.asarray(coords)
+    index  = np.arange(len(coords)) if mask is None else np.flatnonzero(mask)
+    if len(index) < 2:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, np.zeros(0, dtype=coords.dtype)
+
+    tree  = cKDTree(coords[index])
+    # the tree works in float64, so widen the radius slightly and apply the
+    # exact cutoff on distances computed at the coordinates' own precision
+    pairs = tree.query_pairs(cutoff * (1 + 1e-6), output_type='ndarray')
+    i, j  = index[pairs[:, 0]], index[pairs[:, 1]]
+
+    diff = coords[i] - coords[j]
+    distances = np.sqrt(np.matmul(diff[:, None, :], diff[:, :, None])[:, 0, 0])
+    keep = distances <= cutoff
+    return i[keep], j[keep], distances[keep]
+
+if __name__ == '__main__':
+    pass
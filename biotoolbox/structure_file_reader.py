@@ -1,20 +1,29 @@
+import io
 import json
-import tempfile
 import re
+from collections import defaultdict
 
 import Bio
+import Bio.PDB
 from Bio import SeqIO
-from Bio.Data.SCOPData import protein_letters_3to1
+from Bio.PDB.MMCIF2Dict import MMCIF2Dict
+from Bio.Data.PDBData import protein_letters_3to1, protein_letters_3to1_extended
+from Bio.Seq import Seq
+from Bio.SeqIO.PdbIO import AtomIterator
+from Bio.SeqRecord import SeqRecord
 
 
 class PdbSeqResDataParser:
-    def __init__(self, handle, parser_mode, verbose=False):
+    def __init__(self, handle, parser_mode, verbose=False, records=None):
         self.seq_res_seqs = []
         self.idx_to_chain = {}
         self.chain_count = 0
         # self.chain_ids = []
 
-        for record in SeqIO.parse(handle, f"{parser_mode}-seqres"):
+        if records is None:
+            records = SeqIO.parse(handle, f"{parser_mode}-seqres")
+
+        for record in records:
             if verbose:
                 print("Record id %s, chain %s, len %s" % (record.id, record.annotations["chain"], len(record.seq)))
                 print(record.dbxrefs)
@@ -29,13 +38,16 @@ class PdbSeqResDataParser:
 
 
 class PdbAtomDataParser:
-    def __init__(self, handle, parser_mode, verbose=False):
+    def __init__(self, handle, parser_mode, verbose=False, records=None):
         self.idx_to_chain = {}
         self.chain_to_idx = {}
         self.atom_seqs = []
         self.chain_count = 0
 
-        for record in SeqIO.parse(handle, f"{parser_mode}-atom"):
+        if records is None:
+            records = SeqIO.parse(handle, f"{parser_mode}-atom")
+
+        for record in records:
             if verbose:
                 print("Record id %s, chain %s len %s" % (record.id, record.annotations["chain"], len(record.seq)))
                 print(record.seq)
@@ -78,26 +90,110 @@ class StructureContainer:
         return json.dumps(result, default=lambda o: o.__dict__,
                           sort_keys=True, indent=4, skipkeys=True)
 
-def build_structure_container_for_pdb(structure_data):
+def _cif_category(structure_data, category):
+    """
+    Text of one category of an mmCIF file (its `loop_` line and items, up to the next
+    category, block or `#` separator) under a placeholder data block, so MMCIF2Dict can
+    read it without tokenizing the rest of the file.
+    """
+    start = re.search(rf'^(loop_\s*\n)?{re.escape(category)}\.', structure_data, re.MULTILINE)
+    if start is None:
+        return ''
+    stop = re.compile(rf'^(loop_|data_|#|_(?!{re.escape(category[1:])}\.))', re.MULTILINE)
+    end = stop.search(structure_data, start.end())
+    return 'data_input\n' + structure_data[start.start():end.start() if end else len(structure_data)]
+
+# the residue table SeqIO's `cif-seqres` format uses, modified residues map to their parent's letter
+_AA3TO1 = {**protein_letters_3to1, **protein_letters_3to1_extended}
+
+def _cif_seqres_records(mmcif_dict):
+    """
+    SEQRES-equivalent records from an already parsed mmCIF dictionary,
+    mirroring what SeqIO's `cif-seqres` format reads from `_pdbx_poly_seq_scheme`.
+    """
+    asym_ids = mmcif_dict.get('_pdbx_poly_seq_scheme.asym_id', [])
+    mon_ids  = mmcif_dict.get('_pdbx_poly_seq_scheme.mon_id', [])
+    if not isinstance(asym_ids, list):
+        asym_ids, mon_ids = [asym_ids], [mon_ids]
+
+    chains = defaultdict(list)
+    for asym_id, mon_id in zip(asym_ids, mon_ids):
+        chains[asym_id].append(_AA3TO1.get(mon_id, 'X')[:1]) # one letter per residue
+
+    for chain_name, residues in sorted(chains.items()):
+        record = SeqRecord(Seq(''.join(residues)), id=chain_name)
+        record.annotations['chain'] = chain_name
+        yield record
+
+def _parse_in_passes(structure_data, parser_mode):
+    """Parse SEQRES, ATOM sequences and the structure with one reader each"""
+    handle = io.StringIO(str(structure_data))
+
+    seq_res_info = PdbSeqResDataParser(handle, parser_mode)
+    handle.seek(0, 0)
+    atom_info = PdbAtomDataParser(handle, parser_mode)
+
+    handle.seek(0, 0)
+    if parser_mode == 'pdb':
+        structure = Bio.PDB.PDBParser().get_structure('input', handle)
+        id_code = structure.header['idcode']
+    else:
+        structure = Bio.PDB.MMCIFParser().get_structure('input', handle)
+        # TODO(cchandler): See if there's something I can use in biopython to actually get this.
+        # the default parser appears to do it the wrong way.
+        id_code = None
+    return seq_res_info, atom_info, structure, id_code
+
+def _parse_single_pass(structure_data, parser_mode):
+    """
+    Parse the structure once and derive the ATOM sequences from that parse instead
+    of rereading the file for them. SEQRES sequences are not part of the parsed
+    structure, so they are read from the small part of the file holding them:
+    the PDB header before the first coordinate record, or mmCIF's
+    `_pdbx_poly_seq_scheme` category.
+    """
+    structure_data = str(structure_data)
+    if parser_mode == 'pdb':
+        structure = Bio.PDB.PDBParser().get_structure('input', io.StringIO(structure_data))
+        id_code = structure.header['idcode']
+        # SEQRES records live in the header, so only that part needs to be scanned
+        first_coordinate = re.search('^(ATOM  |HETATM|MODEL )', structure_data, re.MULTILINE)
+        header = structure_data[:first_coordinate.start()] if first_coordinate else structure_data
+        seqres_records = SeqIO.parse(io.StringIO(header), 'pdb-seqres') if header else []
+    else:
+        structure = Bio.PDB.MMCIFParser().get_structure('input', io.StringIO(structure_data))
+        id_code = None
+        poly_seq_scheme = _cif_category(structure_data, '_pdbx_poly_seq_scheme')
+        seqres_records = _cif_seqres_records(MMCIF2Dict(io.StringIO(poly_seq_scheme))) if poly_seq_scheme else []
+
+    seq_res_info = PdbSeqResDataParser(None, parser_mode, records=seqres_records)
+    atom_info = PdbAtomDataParser(None, parser_mode,
+                                  records=AtomIterator(id_code or '????', structure))
+    return seq_res_info, atom_info, structure, id_code
+
+def build_structure_container_for_pdb(structure_data, single_pass=False):
+    """
+    Parse a PDB or mmCIF string into a StructureContainer
+    args:
+        :structure_data (str) - contents of the structure file
+        :single_pass (bool)   - parse the structure once and derive the SEQRES/ATOM
+                                sequences from it rather than parsing the text three times
+    returns:
+        :StructureContainer
+    """
     # Test the data to see if this looks like a PDB or an mmCIF
     tester = re.compile('^_', re.MULTILINE)
-    if len(tester.findall(structure_data)) == 0:
+    if tester.search(structure_data) is None:
         # PDB
         parser_mode = 'pdb'
     else:
         parser_mode = 'cif'
 
-    temp = tempfile.TemporaryFile(mode='w+')
-    temp.write(str(structure_data))
-    temp.flush()
-    temp.seek(0, 0)
-
     container_builder = StructureContainer()
 
-    seq_res_info = PdbSeqResDataParser(temp, parser_mode)
-    temp.seek(0, 0)
+    parse = _parse_single_pass if single_pass else _parse_in_passes
     #try:
-    atom_info = PdbAtomDataParser(temp, parser_mode)
+    seq_res_info, atom_info, structure, id_code = parse(structure_data, parser_mode)
     #except ValueError:
     #    # For some reason we literally just can't parse it...
     #    raise ValueError('Biopython doesn\'t know how to parse this PDB')
@@ -107,16 +203,8 @@ def build_structure_container_for_pdb(structure_data):
         print(f"WARNING: The IDs from the seqres lines don't match the IDs from the ATOM lines. This might not work.")
         raise Exception
 
-    temp.seek(0, 0)
     if parser_mode == 'pdb':
-        structure = Bio.PDB.PDBParser().get_structure('input', temp)
-        id_code = structure.header['idcode']
         container_builder.with_id_code(id_code)
-    elif parser_mode == 'cif':
-        structure = Bio.PDB.MMCIFParser().get_structure('input', temp)
-        # TODO(cchandler): See if there's something I can use in biopython to actually get this.
-        # the default parser appears to do it the wrong way.
-        id_code = None
 
     # model = structure[0]
     container_builder.with_structure(structure)
@@ -139,5 +227,4 @@ def build_structure_container_for_pdb(structure_data):
             chain_name_from_seqres = atom_info.idx_to_chain[i]
             container_builder.with_chain(chain_name_from_seqres, None, atom_seq)
 
-    temp.close()
     return container_builder
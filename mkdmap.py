@@ -5,23 +5,28 @@
 Generates a PyTorch distance map from PDB file
 """
 
+import os
 import re
+import sys
+import glob
 import json
 import gzip
 import argparse
 import warnings
 import itertools
 import functools
+import contextlib
+import multiprocessing
 from pathlib import Path
 from collections import defaultdict
 
-import torch
-import numpy as np
+# torch, numpy, scipy and Biopython are imported where they are used, so that
+# argument parsing and --help do not pay for them
 
-from .biotoolbox.structure_file_reader import build_structure_container_for_pdb
-from .biotoolbox.contact_map_builder   import DistanceMapBuilder
+STRUCTURE_SUFFIXES = ('.pdb', '.ent', '.cif', '.mmcif')
 
-def make_distance_map(pdbfile, gzip_compressed=False, atom="CA"):
+def make_distance_map(pdbfile, gzip_compressed=False, atom="CA", single_pass=False, columnar=False,
+                      cutoff=None, dtype=None):
     """
     Generate (diagonalized) atomic distance matrix from a pdbfile 
 
@@ -29,7 +34,15 @@ def make_distance_map(pdbfile, gzip_compressed=False, atom="CA"):
         :pdbfile (str or Path)  - path to structure file
         :gzip_compressed (bool) - file is gzip compressed
         :atom (str)             - atom name to generate distance map
+        :single_pass (bool)     - parse the structure file once (see build_structure_container_for_pdb)
+        :columnar (bool)        - read coordinates straight into arrays, skipping Bio.PDB entirely
+        :cutoff (float)         - keep only pairs within `cutoff` as a sparse map
+        :dtype (str)            - type the map and coordinates are computed in, float64 by default
     """
+    from .biotoolbox.structure_file_reader import build_structure_container_for_pdb
+    from .biotoolbox.contact_map_builder   import DistanceMapBuilder
+    from .biotoolbox.coordinate_reader     import read_atom_table
+
     assert atom in ["CA","CB"], f'Unrecognized atom: {atom}'
 
     if gzip_compressed:
@@ -42,21 +55,25 @@ def make_distance_map(pdbfile, gzip_compressed=False, atom="CA"):
         if hasattr(pdb_raw, 'decode'):
             pdb_raw = pdb_raw.decode()
 
-        structure_container = build_structure_container_for_pdb(pdb_raw) 
-        
-        mapper = DistanceMapBuilder(atom=atom, glycine_hack=-1, verbose=False) # get distances
-        map_ = mapper.generate_map_for_pdb(structure_container) 
+        mapper = DistanceMapBuilder(atom=atom, glycine_hack=-1, verbose=False, cutoff=cutoff,
+                                    dtype=dtype or 'float64') # get distances
+        if columnar:
+            atom_table = read_atom_table(pdb_raw, atoms=("CA", atom))
+            map_ = mapper.generate_map_for_atom_table(atom_table)
+        else:
+            structure_container = build_structure_container_for_pdb(pdb_raw, single_pass=single_pass)
+            map_ = mapper.generate_map_for_pdb(structure_container) 
     return map_.chains
 
 def arguments():
     parser = argparse.ArgumentParser(description="Save PDB file(s) as distance matrices")
     parser.add_argument("input_pdb",
                         type=Path,
-                        help="Input pdbfile")
+                        help="Input pdbfile (with --batch: a directory, glob pattern or manifest file)")
     
     parser.add_argument("output_pt",
                         type=Path,
-                        help="Output PyTorch tensor file")
+                        help="Output PyTorch tensor file (with --batch: output directory)")
 
     parser.add_argument("--xyz",
                         action='store_true',
@@ -67,12 +84,139 @@ def arguments():
                         default="CA",
                         help="Atom type")
 
+    parser.add_argument("--single-pass",
+                        action='store_true',
+                        help="Parse the structure once instead of separately for SEQRES, ATOM and coordinates")
+
+    parser.add_argument("--columnar",
+                        action='store_true',
+                        help="Read coordinates straight into arrays without building a Biopython structure")
+
+    parser.add_argument("--float32",
+                        action='store_true',
+                        help="Store maps and coordinates as float32 instead of float64")
+
+    parser.add_argument("--cutoff",
+                        type=float,
+                        default=None,
+                        help="Only store pairs within this distance, as a sparse COO map")
+
+    parser.add_argument("--all-chains",
+                        action='store_true',
+                        help="Write every chain's map, xyz and sequence into one packed .npz instead of the first chain's tensor")
+
+    parser.add_argument("--batch",
+                        action='store_true',
+                        help="Process every structure named by input_pdb into output_pt/")
+
+    parser.add_argument("-w", "--workers",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="Number of worker processes in batch mode")
+
+    parser.add_argument("--resume",
+                        action='store_true',
+                        help="In batch mode, skip structures whose output already exists")
+
     return parser.parse_args()
 
 def write_tensor(filename, tensor):
-    torch.save(torch.from_numpy(tensor), filename)
+    import torch
+    import numpy as np
+    import scipy.sparse
+
+    if scipy.sparse.issparse(tensor):
+        tensor = to_sparse_tensor(tensor)
+    else:
+        # from_numpy shares the array's memory, nothing is copied before saving
+        tensor = torch.from_numpy(np.ascontiguousarray(tensor))
+    torch.save(tensor, filename)
+
+def to_sparse_tensor(matrix):
+    """Converts a scipy.sparse matrix into a torch sparse COO tensor"""
+    import torch
+    import numpy as np
+
+    matrix  = matrix.tocoo()
+    indices = torch.from_numpy(np.vstack([matrix.row, matrix.col]).astype(np.int64))
+    return torch.sparse_coo_tensor(indices, torch.from_numpy(matrix.data), matrix.shape).coalesce()
+
+def write_packed(fileobj, dmap_info):
+    """
+    Write all chains of a structure into one .npz container with per-chain keys
+    (`<chain>/contact-map`, `<chain>/xyz`, `<chain>/seq`, ...) plus a `chains` index.
+    Sparse maps are stored as their COO components (`<chain>/contact-map/row`, ...).
+    """
+    import numpy as np
+    import scipy.sparse
+
+    packed = {'chains': np.array(list(dmap_info), dtype=str)}
+    for chain, info in dmap_info.items():
+        contact_map = info['contact-map']
+        if scipy.sparse.issparse(contact_map):
+            contact_map = contact_map.tocoo()
+            packed[f'{chain}/contact-map/row']   = contact_map.row
+            packed[f'{chain}/contact-map/col']   = contact_map.col
+            packed[f'{chain}/contact-map/data']  = contact_map.data
+            packed[f'{chain}/contact-map/shape'] = np.array(contact_map.shape)
+        else:
+            packed[f'{chain}/contact-map'] = contact_map
+        packed[f'{chain}/xyz']         = info['xyz']
+        packed[f'{chain}/seq']         = np.array(info['seq'])
+        packed[f'{chain}/final-seq']   = np.array(info['final-seq'])
+        packed[f'{chain}/method']      = np.array(info['method'])
+    np.savez(fileobj, **packed)
+
+def packed_chains(filename):
+    """List the chains stored in a packed container"""
+    import numpy as np
+
+    with np.load(filename) as packed:
+        return packed['chains'].tolist()
+
+def load_packed_chain(filename, chain):
+    """
+    Load a single chain from a packed container. Members of an .npz are read
+    on access, so the other chains are never deserialized.
+    returns:
+        :dict with 'contact-map' (scipy.sparse.coo_matrix for sparse maps), 'xyz', 'seq',
+         'final-seq' and 'method'
+    """
+    import numpy as np
+    import scipy.sparse
+
+    with np.load(filename) as packed:
+        if f'{chain}/xyz' not in packed.files:
+            raise KeyError(f"{chain} not in {filename}")
+        if f'{chain}/contact-map' in packed.files:
+            contact_map = packed[f'{chain}/contact-map']
+        else:
+            contact_map = scipy.sparse.coo_matrix((packed[f'{chain}/contact-map/data'],
+                                                   (packed[f'{chain}/contact-map/row'],
+                                                    packed[f'{chain}/contact-map/col'])),
+                                                  shape=tuple(packed[f'{chain}/contact-map/shape']))
+        return {'contact-map': contact_map,
+                'xyz':         packed[f'{chain}/xyz'],
+                'seq':         str(packed[f'{chain}/seq']),
+                'final-seq':   str(packed[f'{chain}/final-seq']),
+                'method':      str(packed[f'{chain}/method'])}
+
+def _as_dtype(matrix, dtype):
+    import numpy as np
+    import scipy.sparse
+
+    if scipy.sparse.issparse(matrix):
+        return matrix if dtype is None else matrix.astype(dtype, copy=False)
+    return np.asarray(matrix, dtype=dtype)
+
+def filter_map_output(chaindict, dtype=None):
+    """
+    Select the fields to save for every chain. Maps and coordinates are kept as the
+    arrays DistanceMapBuilder produced and are only converted when `dtype` asks for it
+    (make_distance_map builds them in that dtype in the first place, so nothing is copied).
+    """
+    import numpy as np
 
-def filter_map_output(chaindict):
     output_dict = defaultdict(dict)
     for chain in chaindict:
         map_ = chaindict[chain]
@@ -82,10 +226,143 @@ def filter_map_output(chaindict):
         output_dict[chain]['method']      = map_['method']
         output_dict[chain]['seq']         = str(map_['seq'])
         output_dict[chain]['final-seq']   = str(map_['final-seq'])
-        output_dict[chain]['contact-map'] = map_['contact-map'].tolist()
-        output_dict[chain]['xyz'] = map_['xyz']
+        output_dict[chain]['contact-map'] = _as_dtype(map_['contact-map'], dtype)
+        output_dict[chain]['xyz']         = np.asarray(map_['xyz'], dtype=dtype)
     return dict(output_dict)
 
+def save_distance_map(dmap_info, output_pt, xyz=False, all_chains=False):
+    """
+    Write the map (or CA coordinates) of a structure to `output_pt`, or with
+    `all_chains` every chain into one packed container (see write_packed).
+    The file is written under a temporary name first so an interrupted
+    run never leaves a truncated output behind.
+    """
+    partial = output_pt.with_name(output_pt.name + '.part')
+    if all_chains:
+        with open(partial, 'wb') as fileobj:
+            write_packed(fileobj, dmap_info)
+    else:
+        # only the first chain fits into a single tensor
+        chain = list(dmap_info.keys())[0]
+        dmap = dmap_info[chain]['contact-map']
+        xyz_ = dmap_info[chain]['xyz']
+
+        save_tensor = xyz_ if xyz else dmap
+        write_tensor(partial, save_tensor)
+    os.replace(partial, output_pt)
+
+def collect_inputs(source):
+    """
+    Expand the batch input into a list of structure files
+    args:
+        :source (Path) - a directory (searched recursively), a glob pattern,
+                         or a manifest file listing one structure path per line
+    returns:
+        :list of Path, checked for structures that would share an output (see _check_output_names)
+    """
+    if source.is_dir():
+        pdbfiles = sorted(path for path in source.rglob('*')
+                          if path.is_file() and _strip_gz(path).suffix.lower() in STRUCTURE_SUFFIXES)
+    elif glob.has_magic(str(source)):
+        pdbfiles = sorted(Path(path) for path in glob.glob(str(source), recursive=True))
+    else:
+        with open(source, 'r') as manifest:
+            pdbfiles = [Path(line.strip()) for line in manifest
+                        if line.strip() and not line.startswith('#')]
+    _check_output_names(pdbfiles)
+    return pdbfiles
+
+def _strip_gz(path):
+    return path.with_suffix('') if path.suffix == '.gz' else path
+
+def _output_stem(pdbfile):
+    return _strip_gz(pdbfile).stem
+
+def _check_output_names(pdbfiles):
+    """
+    Batch outputs are named after the structure file's stem, so e.g. 1abc.pdb and
+    1abc.cif, or 1abc.pdb in two directories, would overwrite each other (or be
+    skipped by --resume). Raise a ValueError listing such collisions.
+    """
+    by_stem = defaultdict(list)
+    for pdbfile in pdbfiles:
+        by_stem[_output_stem(pdbfile)].append(pdbfile)
+    collisions = {stem: paths for stem, paths in by_stem.items() if len(paths) > 1}
+    if collisions:
+        examples = '; '.join(f"{stem}: {', '.join(map(str, paths))}" for stem, paths in list(collisions.items())[:5])
+        raise ValueError(f"{len(collisions)} output names are shared by several structures ({examples})")
+
+def _output_kind(options):
+    if options['all_chains']:
+        return 'all chains'
+    return 'xyz' if options['xyz'] else 'dmap'
+
+def _batch_job(job):
+    """
+    Worker for batch mode. Never raises, failures are reported back
+    as an error message so the rest of the batch can go on.
+    """
+    pdbfile, output_pt, options = job
+    try:
+        with warnings.catch_warnings(), open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            warnings.simplefilter('ignore')
+            dmap_info = filter_map_output(make_distance_map(pdbfile,
+                                                            gzip_compressed=pdbfile.suffix == '.gz',
+                                                            atom=options['atom'],
+                                                            single_pass=options['single_pass'],
+                                                            columnar=options['columnar'],
+                                                            cutoff=options['cutoff'],
+                                                            dtype=options['dtype']),
+                                          dtype=options['dtype'])
+            save_distance_map(dmap_info, output_pt, xyz=options['xyz'], all_chains=options['all_chains'])
+    except Exception as e:
+        return pdbfile, output_pt, f"{type(e).__name__}: {e}"
+    return pdbfile, output_pt, None
+
+def run_batch(pdbfiles, output_dir, workers=1, resume=False, **options):
+    """
+    Make distance maps for many structures with a pool of worker processes.
+    Results are reported as they finish and failing structures are skipped.
+    args:
+        :pdbfiles (list of Path) - structure files
+        :output_dir (Path)       - directory receiving one `<stem>.pt` (`<stem>.npz` with all_chains) per structure
+        :workers (int)           - number of worker processes
+        :resume (bool)           - skip structures whose output already exists
+        :options                 - atom, xyz, all_chains, dtype, cutoff, single_pass, columnar
+    returns:
+        :(done, skipped, failed) counts
+    """
+    _check_output_names(pdbfiles)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    jobs, skipped = [], 0
+    suffix = '.npz' if options['all_chains'] else '.pt'
+    for pdbfile in pdbfiles:
+        output_pt = output_dir / (_output_stem(pdbfile) + suffix)
+        if resume and output_pt.exists():
+            skipped += 1
+            continue
+        jobs.append((pdbfile, output_pt, options))
+
+    done = failed = 0
+    chunksize = max(1, min(64, len(jobs) // (4 * max(workers, 1))))
+    with contextlib.ExitStack() as stack:
+        if workers > 1:
+            pool    = stack.enter_context(multiprocessing.Pool(workers))
+            results = pool.imap_unordered(_batch_job, jobs, chunksize=chunksize)
+        else:
+            results = map(_batch_job, jobs)
+
+        for pdbfile, output_pt, error in results:
+            if error is None:
+                done += 1
+                print(f"{pdbfile} -> {output_pt} ({_output_kind(options)})", flush=True)
+            else:
+                failed += 1
+                print(f"FAILED {pdbfile}: {error}", file=sys.stderr, flush=True)
+
+    print(f"Done! {done} written, {skipped} already present, {failed} failed.")
+    return done, skipped, failed
+
 if __name__ == '__main__':
     args = arguments()
     
@@ -93,19 +370,23 @@ if __name__ == '__main__':
     pdb  = args.input_pdb
     pt   = args.output_pt
 
-    with warnings.catch_warnings():
-        warnings.simplefilter('ignore')
-        dmap_info = filter_map_output(make_distance_map(pdb, gzip_compressed=False, atom=atom))
-    
-    # extract only the first contact map for a specific chain!!!!!!
-    # needs to be changed to emit all chains ...
-    chain = list(dmap_info.keys())[0]
-    dmap = np.array(dmap_info[chain]['contact-map'])
-    xyz  = np.array(dmap_info[chain]['xyz'])
+    dtype = 'float32' if args.float32 else None
 
-    save_tensor = xyz if args.xyz else dmap
-    
-    write_tensor(pt, save_tensor)
-    
-    print(f"{pdb} -> {pt} ({'xyz' if args.xyz else 'dmap'})")
+    if args.batch:
+        run_batch(collect_inputs(pdb), pt,
+                  workers=args.workers, resume=args.resume,
+                  atom=atom, xyz=args.xyz, all_chains=args.all_chains, dtype=dtype, cutoff=args.cutoff,
+                  single_pass=args.single_pass, columnar=args.columnar)
+    else:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            dmap_info = filter_map_output(make_distance_map(pdb, gzip_compressed=False, atom=atom,
+                                                            single_pass=args.single_pass,
+                                                            columnar=args.columnar,
+                                                            cutoff=args.cutoff,
+                                                            dtype=dtype),
+                                          dtype=dtype)
+
+        save_distance_map(dmap_info, pt, xyz=args.xyz, all_chains=args.all_chains)
 
+        print(f"{pdb} -> {pt} ({_output_kind(vars(args))})")
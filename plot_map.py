@@ -12,9 +12,6 @@ Visualize one contact map.
 import argparse
 from pathlib import Path
 
-import torch
-import matplotlib.pyplot as plt
-
 # see adjacency.py
 from .biotoolbox.adjacency import Composer, AdjacencyMatrixMaker, CoordLoader
 
@@ -35,19 +32,51 @@ def arguments():
     return parser.parse_args()
 
 def to_numpy(tnsr):
+    if tnsr.is_sparse:
+        return tnsr.to_dense().numpy()
     return tnsr.numpy()
 
+def sparse_distances_to_numpy(tnsr):
+    """
+    Densify a sparse distance map for display, pairs beyond its cutoff
+    are left blank (NaN) and the diagonal, which is not stored, is zero.
+    """
+    import numpy as np
+
+    if not tnsr.is_sparse:
+        return tnsr.numpy()
+    tnsr = tnsr.coalesce()
+    mat = np.full(tnsr.shape, np.nan)
+    row, col = tnsr.indices().numpy()
+    mat[row, col] = tnsr.values().numpy()
+    np.fill_diagonal(mat, 0.)
+    return mat
+
+def threshold_structure(adjmapper):
+    """
+    Thresholds either input kind: N x 3 coordinates go through the neighbor search
+    of `AdjacencyMatrixMaker.convert_coords`, distance maps through `convert`.
+    """
+    def threshold(tnsr):
+        if not tnsr.is_sparse and tnsr.shape[0] != tnsr.shape[1] and tnsr.shape[1] == 3:
+            return adjmapper.convert_coords(tnsr)
+        return adjmapper(tnsr)
+    return threshold
+
 def load_pt(filename):
+    import torch
     return torch.load(filename, map_location=torch.device("cpu"))
 
 if __name__ == '__main__':
     args = arguments()
+    import matplotlib.pyplot as plt
+
     if args.t is not None:
-        adjmapper = AdjacencyMatrixMaker(args.t)
+        pipeline = Composer(load_pt, threshold_structure(AdjacencyMatrixMaker(args.t)), to_numpy)
     else:
-        adjmapper = lambda x: x
+        pipeline = Composer(load_pt, CoordLoader(silent_if_square=True), sparse_distances_to_numpy)
     
-    mat = Composer(load_pt, CoordLoader(silent_if_square=True), adjmapper, to_numpy)(args.input_protein)
+    mat = pipeline(args.input_protein)
     
     fig, ax = plt.subplots(1)
     
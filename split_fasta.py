@@ -6,18 +6,29 @@ Split or filter a
 """
 
 import io
+import os
 import re
 import sys
-import gzip
+import time
+import heapq
 import pathlib
 import secrets 
 import operator
 import argparse
 import textwrap
-import itertools
+
+try:
+    from .biotoolbox.gen import fasta_reader, fasta_byte_ranges, is_gzipped
+    from .biotoolbox.bgzf import is_bgzf
+except ImportError: # run as a script rather than as part of the package
+    from biotoolbox.gen import fasta_reader, fasta_byte_ranges, is_gzipped
+    from biotoolbox.bgzf import is_bgzf
 
 clear = f"\r{100 * ' '}\r"
 FASTA_STOP_CODON = '*'
+PROGRESS_INTERVAL = 0.5 # seconds between progress updates
+RANGES_PER_WORKER = 4   # byte ranges per worker process in parallel mode, for load balancing
+MANIFEST = "manifest.tsv"
 
 def _valid_condition(cond):
     condition_structure = "(<|>|<=|>=)(\d+)" 
@@ -42,6 +53,131 @@ def _construct_conditional(conditions):
         return all(evaluated)
     return conditional, conditionals
 
+class Progress(object):
+    """Rewrites a status line, at most once every `interval` seconds"""
+    def __init__(self, interval=PROGRESS_INTERVAL, stream=None):
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.last = -interval
+
+    def __call__(self, message):
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.stream.write(f"{clear}{message}")
+            self.stream.flush()
+            self.last = now
+
+def _record_id(header):
+    return header.lstrip(">").rstrip().split(" ")[0].replace("/", "-").replace("|", "__")
+
+def _selected(records, allow_stop_codons, condition, counts):
+    """
+    Yields the records to dump: no stop codons unless allowed, lengths satisfying `condition`.
+    `counts` is updated in place with the records considered and dumped.
+    """
+    for header, sequence in records:
+        if not allow_stop_codons and FASTA_STOP_CODON in sequence:
+            continue
+        counts[0] += 1
+        if condition(len(sequence)):
+            counts[1] += 1
+            yield header, sequence
+
+class ShardWriter(object):
+    """
+    Writes records into a few large FASTA files instead of one file per record:
+    either `shards` files, each record going to the shard holding the fewest records
+    (or residues) so far, or consecutive chunks of `chunk_size` records (or residues,
+    a chunk is closed once it reaches that size, records are never split).
+    Where every record went is listed in a manifest (id, shard, byte offset of the
+    record, sequence length) and each shard gets a `.fai` index, so single records
+    can still be fetched with biotoolbox.fasta_index.IndexedFasta. Repeated record
+    names are renamed `name.1`, `name.2`, ... like split mode's files, so every name
+    is in exactly one shard.
+    """
+    def __init__(self, outpath, shards=None, chunk_size=None, balance='records'):
+        """
+        args:
+            :outpath (Path)    - output directory
+            :shards (int)      - number of balanced shards
+            :chunk_size (int)  - records (or residues) per chunk, if `shards` is not given
+            :balance (str)     - 'records' or 'residues', what is balanced or counted per chunk
+        """
+        if (shards is None) == (chunk_size is None):
+            raise ValueError("Give either a number of shards or a chunk size")
+        self.outpath = outpath
+        self.chunk_size = chunk_size
+        self.by_residues = balance == 'residues'
+        self.files = []   # (fasta, fai) handles of each shard
+        self.offsets = [] # bytes written to each shard
+        self.names = set() # record names written so far, across all shards
+        self.loads = []   # (records or residues written, shard), a heap when balancing
+        self.manifest = open(outpath / MANIFEST, 'w')
+        self.manifest.write("id\tshard\toffset\tlength\n")
+        for _ in range(shards or 0):
+            self._open_shard()
+
+    def _open_shard(self):
+        k = len(self.files)
+        name = self.outpath / f"shard_{k:05d}.fasta"
+        self.files.append((open(name, 'wb'), open(f"{name}.fai", 'w')))
+        self.offsets.append(0)
+        self.loads.append((0, k))
+
+    def _next_shard(self):
+        if self.chunk_size is None:
+            return self.loads[0][1] # least loaded, top of the heap
+        if not self.loads or self.loads[-1][0] >= self.chunk_size:
+            self._open_shard()
+        return len(self.files) - 1
+
+    def _unique_name(self, name):
+        """`name`, or like split mode's file names `name.1`, `name.2`, ... if it was written before"""
+        unique, i = name, 1
+        while unique in self.names:
+            unique = f"{name}.{i}"
+            i += 1
+        self.names.add(unique)
+        return unique
+
+    def write(self, header, sequence):
+        k = self._next_shard()
+        fasta, fai = self.files[k]
+        words = header[1:].split(maxsplit=1)
+        name  = words[0] if words else ''
+        unique = self._unique_name(name)
+        if unique != name:
+            # records are looked up by the first word of their header
+            header = f">{unique}{header[1:].lstrip()[len(name):]}"
+            name = unique
+        head, body = f"{header}\n".encode(), f"{sequence}\n".encode()
+        offset = self.offsets[k]
+        fasta.write(head + body)
+        # sequences are written on one line
+        n = len(sequence)
+        fai.write(f"{name}\t{n}\t{offset + len(head)}\t{n}\t{n + 1 if n else 0}\n")
+        self.manifest.write(f"{name}\t{pathlib.Path(fasta.name).name}\t{offset}\t{n}\n")
+        self.offsets[k] += len(head) + len(body)
+
+        load = len(sequence) if self.by_residues else 1
+        if self.chunk_size is None:
+            count, _ = self.loads[0]
+            heapq.heapreplace(self.loads, (count + load, k))
+        else:
+            self.loads[-1] = (self.loads[-1][0] + load, k)
+
+    def close(self):
+        for fasta, fai in self.files:
+            fasta.close()
+            fai.close()
+        self.manifest.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 def arguments():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("-i", help="Input filename", type=pathlib.Path, default=None, metavar="INPUT")
@@ -49,6 +185,17 @@ def arguments():
     parser.add_argument("-s", "--include-stops", help="Include sequences with stop codons",
                         default=False, action='store_true', dest='allow_stop_codons')
     parser.add_argument("--filter", dest="filter_only", action='store_true', default=False)
+    parser.add_argument("--shards", help="Write N balanced shard files and a manifest instead of one file per record",
+                        type=int, default=None, metavar="N")
+    parser.add_argument("--chunk-size", help="Write chunk files of N records (or residues, see --balance) "
+                                             "and a manifest instead of one file per record",
+                        type=int, default=None, metavar="N", dest="chunk_size")
+    parser.add_argument("--balance", help="What --shards balances and --chunk-size counts",
+                        choices=("records", "residues"), default="records")
+    parser.add_argument("-t", "--threads", help="Threads decompressing BGZF input (default: number of CPUs)",
+                        type=int, default=None)
+    parser.add_argument("-w", "--workers", help="Worker processes splitting byte ranges of the input in parallel "
+                                                 "(plain or BGZF input files only)", type=int, default=1)
     parser.add_argument("--assert", dest='assertion',
                         type=_valid_condition,
                         nargs='+',
@@ -57,87 +204,129 @@ def arguments():
 
     args = parser.parse_args()
     args.condition, _ = _construct_conditional(args.assertion)
+    args.sharded = args.shards is not None or args.chunk_size is not None
+    if args.shards is not None and args.chunk_size is not None:
+        parser.error("--shards and --chunk-size are mutually exclusive")
+    if args.sharded and args.filter_only:
+        parser.error("--filter writes a single file, it cannot be sharded")
+    if any(n is not None and n < 1 for n in (args.shards, args.chunk_size)):
+        parser.error("--shards and --chunk-size must be positive")
     if not args.o.exists() and not args.filter_only:
         args.o.mkdir(parents=True)
 
     if args.i is not None and not args.i.exists():
         raise FileNotFoundError(f"{args.i} doesn't exist")
-    else:
-        args.i = (sys.stdin if args.i is None else open(args.i, 'r'))
+    elif args.i is None:
+        args.i = sys.stdin
+    # paths are opened by fasta_reader, which recognizes gzip and BGZF input
+
+    if args.workers > 1 and (args.i is sys.stdin or (is_gzipped(args.i) and not is_bgzf(args.i))):
+        parser.error("--workers needs a plain or BGZF input file (see biotoolbox.bgzf.bgzip)")
 
     return args
 
-def is_gzipped(filepath):
-    with open(filepath, 'rb') as f:
-        return f.read(2) == b'\x1f\x8b'
+def _output_filename(outpath, ID):
+    filename = outpath / (ID + '.fasta')
+    i = 1
+    while filename.exists():
+        filename = outpath / f'{ID}.{i}.fasta'
+        i += 1
+    return filename
 
-def fasta_reader(handle, width=None):
+def _split_range(task):
     """
-    Reads a FASTA file, yielding header, sequence pairs for each sequence recovered
-    args:
-        :handle (str, pathliob.Path, or file pointer) - fasta to read from
-        :width (int or None) - formats the sequence to have max `width` character per line.
-                               If <= 0, processed as None. If None, there is no max width.
-    yields:
-        :(header, sequence) tuples
+    Worker of the parallel mode: filters the records of one byte range of the input
+    and writes them to a part file (--filter) or, one file per record, to a part directory
     returns:
-        :None
+        :(records seen, records dumped, IDs of the dumped records in split mode)
     """
-    FASTA_STOP_CODON = "*"
-    import io, textwrap, itertools
-    
-    if not isinstance(handle, io.TextIOWrapper):
-        handle = gzip.open(handle, 'rt') if is_gzipped(handle) else open(handle, 'r')
-
-    width  = width if isinstance(width, int) and width > 0 else None
-    try:
-        for is_header, group in itertools.groupby(handle, lambda line: line.startswith(">")):
-            if is_header:
-                header = group.__next__().strip()
-            else:
-                seq    = ''.join(line.strip() for line in group).strip().rstrip(FASTA_STOP_CODON)
-                if width is not None:
-                    seq = textwrap.fill(seq, width)
-                yield header, seq
-    finally:
-        if not handle.closed:
-            handle.close()
+    path, byte_range, part, allow_stop_codons, assertion, filter_only = task
+    condition, _ = _construct_conditional(assertion)
+    counts, ids = [0, 0], []
+    records = _selected(fasta_reader(path, byte_range=byte_range), allow_stop_codons, condition, counts)
+    if filter_only:
+        with open(part, 'w') as outfile:
+            for header, sequence in records:
+                outfile.write(f"{header}\n{sequence}\n")
+    else:
+        part.mkdir(exist_ok=True)
+        for j, (header, sequence) in enumerate(records):
+            with open(part / f"{j}.fasta", 'w') as outfile:
+                outfile.write(f"{header}\n{sequence}\n")
+            ids.append(_record_id(header))
+    return counts[0], counts[1], ids
 
-if __name__ == "__main__":
-    args = arguments()
-    spliterator = fasta_reader(args.i)
-    if not args.allow_stop_codons:
-        spliterator = itertools.filterfalse(lambda tup: FASTA_STOP_CODON in tup[1], spliterator)
+def split_parallel(args, progress):
+    """
+    Splits the input into byte ranges at record boundaries, filters and writes each range
+    in a worker process, then merges the parts in input order so that the output is the
+    same as a serial run
+    """
+    import shutil
+    import contextlib
+    import concurrent.futures
 
-    dumped = 0
-    total = 0
+    ranges = fasta_byte_ranges(args.i, args.workers * RANGES_PER_WORKER)
     if args.filter_only:
-        outfile = open(args.o, 'w')
-        def emit_outfile(outpath, ID):
-            return outfile 
+        parts = [args.o.with_name(f"{args.o.name}.part{k}") for k in range(len(ranges))]
     else:
-        def emit_outfile(outpath, ID):
-            filename = outpath / (ID + '.fasta')
-            i = 1
-            while filename.exists():
-                filename = outpath / ID + f'.{i}.fasta'
-                i += 1
-            return open(filename, 'w')
-
-    for i, (header, sequence) in enumerate(spliterator, 1):
-        total += 1
-        if not args.condition(len(sequence.replace('\n', ''))):
-            continue
-        ID = header.lstrip(">").rstrip().split(" ")[0].replace("/", "-").replace("|", "__")
-        outfile = emit_outfile(args.o, ID)
-        print(header, file=outfile)
-        print(sequence, file=outfile)
-        print(f"{clear}[{i}] {outfile.name}", end='', flush=True)
-        if not args.filter_only:
-            outfile.close()
-        dumped += 1
+        parts = [args.o / f".part{k}" for k in range(len(ranges))]
+    # sharded output is filtered into part files and distributed in input order
+    single_file = args.filter_only or args.sharded
+    tasks = [(args.i, byte_range, part, args.allow_stop_codons, args.assertion, single_file)
+             for byte_range, part in zip(ranges, parts)]
 
-    if args.filter_only:
-        outfile.close()
+    dumped = total = 0
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as executor, \
+         (open(args.o, 'wb') if args.filter_only else contextlib.nullcontext()) as outfile, \
+         (_shard_writer(args) if args.sharded else contextlib.nullcontext()) as shards:
+        for k, ((seen, written, ids), part) in enumerate(zip(executor.map(_split_range, tasks), parts), 1):
+            if args.filter_only:
+                with open(part, 'rb') as partfile:
+                    shutil.copyfileobj(partfile, outfile)
+                os.remove(part)
+            elif args.sharded:
+                for header, sequence in fasta_reader(part):
+                    shards.write(header, sequence)
+                os.remove(part)
+            else:
+                for j, ID in enumerate(ids):
+                    os.replace(part / f"{j}.fasta", _output_filename(args.o, ID))
+                part.rmdir()
+            total  += seen
+            dumped += written
+            progress(f"[{k}/{len(tasks)} ranges] dumped {dumped}/{total}")
+    return dumped, total
 
-    print(f"{clear}Done! Dumped {dumped}/{total} separate fasta files into {args.o}.")
+def _shard_writer(args):
+    return ShardWriter(args.o, args.shards, args.chunk_size, args.balance)
+
+def split_serial(args, progress):
+    counts = [0, 0]
+    records = _selected(fasta_reader(args.i, threads=args.threads), args.allow_stop_codons, args.condition, counts)
+    if args.sharded:
+        with _shard_writer(args) as shards:
+            for i, (header, sequence) in enumerate(records, 1):
+                shards.write(header, sequence)
+                progress(f"[{i}] {header[:80]}")
+    elif args.filter_only:
+        with open(args.o, 'w') as outfile:
+            for i, (header, sequence) in enumerate(records, 1):
+                outfile.write(f"{header}\n{sequence}\n")
+                progress(f"[{i}] {outfile.name}")
+    else:
+        for i, (header, sequence) in enumerate(records, 1):
+            with open(_output_filename(args.o, _record_id(header)), 'w') as outfile:
+                outfile.write(f"{header}\n{sequence}\n")
+            progress(f"[{i}] {outfile.name}")
+    return counts[1], counts[0]
+
+if __name__ == "__main__":
+    args = arguments()
+    progress = Progress()
+    split = split_parallel if args.workers > 1 else split_serial
+    dumped, total = split(args, progress)
+    if args.sharded:
+        print(f"{clear}Done! Dumped {dumped}/{total} sequences into shards in {args.o}, listed in {args.o / MANIFEST}.")
+    else:
+        print(f"{clear}Done! Dumped {dumped}/{total} separate fasta files into {args.o}.")
@@ -0,0 +1,33 @@
+import io
+import sys
+from pathlib import Path
+from collections import defaultdict
+
+from Bio.PDB import PDBParser, MMCIFIO
+
+REPO = Path(__file__).resolve().parents[1]
+SAMPLES = REPO / 'samples'
+
+# the scripts and biotoolbox are used from a checkout, not installed
+sys.path.insert(0, str(REPO))
+
+def as_cif(pdbfile, modified=()):
+    """
+    mmCIF rendering of a PDB sample, with its SEQRES as a _pdbx_poly_seq_scheme loop
+    whose first residues are replaced by the `modified` residue codes
+    """
+    out = io.StringIO()
+    cif = MMCIFIO()
+    cif.set_structure(PDBParser(QUIET=True).get_structure(pdbfile.stem, pdbfile))
+    cif.save(out)
+    three = defaultdict(list)
+    with open(pdbfile) as handle:
+        for line in handle:
+            if line.startswith('SEQRES'):
+                three[line[11]].extend(line[19:].split())
+    for mon_ids in three.values():
+        mon_ids[:len(modified)] = modified
+    scheme = "loop_\n_pdbx_poly_seq_scheme.asym_id\n_pdbx_poly_seq_scheme.seq_id\n_pdbx_poly_seq_scheme.mon_id\n"
+    scheme += ''.join(f"{chain} {i + 1} {mon_id}\n" for chain, mon_ids in three.items()
+                      for i, mon_id in enumerate(mon_ids))
+    return out.getvalue() + scheme + "#\n"
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from Bio.PDB import PDBParser
+
+from biotoolbox.contact_map_builder import DistanceMapBuilder, INCOMPARABLE_PAIR, KEY_NOT_FOUND
+
+from conftest import SAMPLES
+
+def _loop_dist_matrix(residues, atom, glycine_hack):
+    """The per-pair loop DistanceMapBuilder used before it was vectorized"""
+    def euclidean(res1, atom1, res2, atom2):
+        return res1[atom1] - res2[atom2]
+
+    def residue_dist(residue_one, residue_two):
+        if bool({residue_one, residue_two} & {None}):
+            return INCOMPARABLE_PAIR
+        try:
+            dist = euclidean(residue_one, atom, residue_two, atom)
+        except KeyError:
+            if atom == "CB":
+                if glycine_hack < 0:
+                    try:
+                        dist = euclidean(residue_one, 'CA', residue_two, 'CA')
+                    except KeyError:
+                        dist = KEY_NOT_FOUND
+                else:
+                    dist = glycine_hack
+            else:
+                dist = KEY_NOT_FOUND
+        return dist
+
+    answer = np.zeros((len(residues), len(residues)), np.float64)
+    for row, residue_one in enumerate(residues):
+        for col, residue_two in enumerate(residues[row:], start=row):
+            answer[row, col] = residue_dist(residue_one, residue_two)
+            answer[col, row] = answer[row, col]
+    return answer
+
+def _chains(pdbfile):
+    model = PDBParser(QUIET=True).get_structure(pdbfile.stem, pdbfile)[0]
+    for chain in model:
+        residues = [residue for residue in chain if 'CA' in residue]
+        # an unresolved residue, as left by SEQRES alignment
+        yield residues[:5] + [None] + residues[5:]
+
+@pytest.mark.parametrize('pdbfile', sorted(SAMPLES.glob('*.pdb')), ids=lambda path: path.name)
+@pytest.mark.parametrize('atom, glycine_hack', [('CA', -1), ('CB', -1), ('CB', 5.0)])
+def test_vectorized_map_matches_loop(pdbfile, atom, glycine_hack):
+    builder = DistanceMapBuilder(atom=atom, verbose=False, glycine_hack=glycine_hack)
+    for residues in _chains(pdbfile):
+        distances, _ = builder._DistanceMapBuilder__calc_dist_matrix(residues)
+        expected = _loop_dist_matrix(residues, atom, glycine_hack)
+        assert np.array_equal(distances, expected)
+
+@pytest.mark.parametrize('pdbfile', sorted(SAMPLES.glob('*.pdb')), ids=lambda path: path.name)
+def test_float32_map_is_built_in_float32(pdbfile):
+    wide   = DistanceMapBuilder(atom='CB', verbose=False)
+    narrow = DistanceMapBuilder(atom='CB', verbose=False, dtype=np.float32)
+    for residues in _chains(pdbfile):
+        expected, _ = wide._DistanceMapBuilder__calc_dist_matrix(residues)
+        distances, _ = narrow._DistanceMapBuilder__calc_dist_matrix(residues)
+        assert distances.dtype == np.float32
+        assert np.allclose(distances, expected, rtol=1e-5, atol=1e-4)
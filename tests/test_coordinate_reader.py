@@ -0,0 +1,34 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from biotoolbox.contact_map_builder import DistanceMapBuilder
+from biotoolbox.coordinate_reader import read_atom_table
+from biotoolbox.structure_file_reader import build_structure_container_for_pdb
+
+from conftest import SAMPLES, as_cif
+
+PDB_FILES = sorted(SAMPLES.glob('*.pdb'))
+
+def _maps(structure_data, atom, glycine_hack):
+    """(generate_map_for_pdb chains, generate_map_for_atom_table chains) of one structure"""
+    builder = DistanceMapBuilder(atom=atom, glycine_hack=glycine_hack, verbose=False)
+    with contextlib.redirect_stdout(io.StringIO()): # the Bio.PDB path prints every sequence
+        objects = builder.generate_map_for_pdb(build_structure_container_for_pdb(structure_data))
+    table = builder.generate_map_for_atom_table(read_atom_table(structure_data, atoms=('CA', atom)))
+    return objects.chains, table.chains
+
+@pytest.mark.parametrize('pdbfile', PDB_FILES, ids=lambda path: path.name)
+@pytest.mark.parametrize('cif', [False, True], ids=['pdb', 'cif'])
+@pytest.mark.parametrize('atom, glycine_hack', [('CA', -1), ('CB', -1), ('CB', 5.0)])
+def test_atom_table_map_matches_structure_map(pdbfile, cif, atom, glycine_hack):
+    data = as_cif(pdbfile) if cif else pdbfile.read_text()
+    objects, table = _maps(data, atom, glycine_hack)
+    # chains without a CA atom get an empty map from the Bio.PDB path only
+    assert set(table) == {name for name, chain in objects.items() if len(chain['seq'])}
+    for name, chain in table.items():
+        assert chain['seq'] == objects[name]['seq']
+        np.testing.assert_allclose(chain['contact-map'], objects[name]['contact-map'], atol=1e-4, err_msg=name)
+        np.testing.assert_allclose(chain['xyz'], objects[name]['xyz'], atol=1e-4, err_msg=name)
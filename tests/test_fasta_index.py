@@ -0,0 +1,37 @@
+import pytest
+
+from biotoolbox.fasta_index import IndexedFasta
+from split_fasta import ShardWriter
+
+@pytest.mark.parametrize('shards', [1, 2])
+def test_shard_writer_renames_duplicate_names(tmp_path, shards):
+    with ShardWriter(tmp_path, shards=shards) as writer:
+        for header, sequence in [('>a first', 'AC'), ('>b', 'T'), ('>a second', 'GG'), ('>a', 'C')]:
+            writer.write(header, sequence)
+    manifest = (tmp_path / 'manifest.tsv').read_text().splitlines()[1:]
+    names = [line.split('\t')[0] for line in manifest]
+    assert names == ['a', 'b', 'a.1', 'a.2']
+
+    sequences = {}
+    for shard in {line.split('\t')[1] for line in manifest}:
+        with IndexedFasta(tmp_path / shard) as fasta:
+            sequences.update(zip(fasta.keys(), fasta.fetch_many(fasta.keys())))
+    assert sequences == {'a': 'AC', 'b': 'T', 'a.1': 'GG', 'a.2': 'C'}
+    assert '>a.1 second\n' in ''.join(path.read_text() for path in tmp_path.glob('shard_*.fasta'))
+
+def test_shard_writer_index_serves_records(tmp_path):
+    with ShardWriter(tmp_path, shards=2) as writer:
+        for name, sequence in [('a', 'AC'), ('b', 'GGT'), ('c', '')]:
+            writer.write(f'>{name}', sequence)
+    with IndexedFasta(tmp_path / 'shard_00000.fasta') as fasta:
+        assert fasta.fetch_many(['c', 'a']) == ['', 'AC']
+
+def test_indexed_fasta_rejects_duplicate_names_in_fai(tmp_path):
+    fasta = tmp_path / 'dup.fasta'
+    fasta.write_text('>a\nAC\n>a\nGG\n')
+    (tmp_path / 'dup.fasta.fai').write_text('a\t2\t3\t2\t3\na\t2\t9\t2\t3\n')
+    with pytest.raises(ValueError, match='more than once'):
+        IndexedFasta(fasta)
+    (tmp_path / 'dup.fasta.fai').unlink()
+    with pytest.raises(ValueError, match='more than once'):
+        IndexedFasta(fasta) # building the index rejects them too
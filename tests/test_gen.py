@@ -0,0 +1,30 @@
+import io
+
+import pytest
+
+from biotoolbox.gen import fasta_reader
+from biotoolbox.fasta_index import build_fasta_index
+
+FASTA = (b'junk before the first record\n'
+         b'>a first > record\nACGT\nAC\n'
+         b'>b\n\n'
+         b'>c\r\nGG*\r\n'
+         b'>d\n' + b'ACGT' * 1000 + b'\n'
+         b'>e\n' + b'\n'.join([b'ACGTACGTAC'] * 300) + b'\n')
+
+EXPECTED = [('>a first > record', 'ACGTAC'), ('>b', ''), ('>c', 'GG'),
+            ('>d', 'ACGT' * 1000), ('>e', 'ACGTACGTAC' * 300)]
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 1000, 2**22])
+def test_records_do_not_depend_on_chunks(chunk_size):
+    assert list(fasta_reader(io.BytesIO(FASTA), chunk_size=chunk_size)) == EXPECTED
+    raw = [(bytes(header).decode(), bytes(seq).decode())
+           for header, seq in fasta_reader(io.BytesIO(FASTA), raw=True, chunk_size=chunk_size)]
+    assert raw == EXPECTED
+
+def test_record_spanning_many_chunks(tmp_path):
+    fasta = tmp_path / 'long.fasta'
+    fasta.write_bytes(b'>long\n' + b'ACGT' * 2**16 + b'\n>short\nA\n')
+    records = list(fasta_reader(fasta, chunk_size=2**10))
+    assert [(header, len(seq)) for header, seq in records] == [('>long', 2**18), ('>short', 1)]
+    assert [(entry.name, entry.offset) for entry in build_fasta_index(fasta)] == [('long', 6), ('short', 2**18 + 14)]
@@ -0,0 +1,51 @@
+import sys
+import subprocess
+
+import pytest
+
+from conftest import REPO
+
+HEAVY = ('torch', 'faiss', 'sklearn', 'matplotlib')
+# the library and the CLIs import in ~0.1 s; sklearn alone takes ~1 s and torch several,
+# the margin keeps loaded CI hosts from failing
+MAX_IMPORT_SECONDS = 2.0
+
+def _import_seconds(stderr):
+    """Total time of the top-level imports `-X importtime` reports after interpreter startup"""
+    total, started = 0, False
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        if name.startswith('  '): # nested import, counted by its parent
+            continue
+        if started and cumulative.strip().isdigit():
+            total += int(cumulative)
+        started = started or name.strip() == 'site'
+    return total / 1e6
+
+def _run(code, cwd):
+    """Run `code` in a fresh interpreter, returns (stdout, heavy modules it imported, import seconds)"""
+    check = f"{code}\nimport sys; print(' '.join(m for m in {HEAVY!r} if m in sys.modules), file=sys.stderr)"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', check], cwd=cwd,
+                            capture_output=True, text=True, check=True)
+    return result.stdout, result.stderr.splitlines()[-1].split(), _import_seconds(result.stderr)
+
+def test_library_import_is_light():
+    _, heavy, seconds = _run("import biotoolbox, biotoolbox.dbutils", REPO)
+    assert heavy == []
+    assert seconds < MAX_IMPORT_SECONDS
+
+@pytest.mark.parametrize('script', ['mkdmap', 'plot_map', 'split_fasta'])
+def test_cli_help_is_light(script):
+    # the scripts use relative imports, so they run as modules of the checkout
+    run = ("import runpy, sys\n"
+           f"sys.argv = ['{script}', '--help']\n"
+           "try:\n"
+           f"    runpy.run_module('{REPO.name}.{script}', run_name='__main__', alter_sys=True)\n"
+           "except SystemExit:\n"
+           "    pass")
+    stdout, heavy, seconds = _run(run, REPO.parent)
+    assert stdout.startswith('usage:')
+    assert heavy == []
+    assert seconds < MAX_IMPORT_SECONDS
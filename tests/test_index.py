@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from biotoolbox.dbutils.mmdb import MemoryMappedDatasetWriter, MemoryMappedDatasetReader
+from biotoolbox.dbutils.index import KNNDatabase, BruteForceIndex, load_knn_db
+
+N, D, K = 300, 16, 5
+
+@pytest.fixture
+def dataset(tmp_path):
+    matrix = np.random.default_rng(0).normal(scale=3, size=(N, D)).astype(np.float32)
+    writer = MemoryMappedDatasetWriter(tmp_path / 'db', embedding_dim=D, shard_size=128, start=True)
+    writer.set_many([f"seq{i}" for i in range(N)], matrix, commit=True)
+    writer.close()
+    return tmp_path / 'db', matrix
+
+def _knn_db(path, index):
+    return KNNDatabase(MemoryMappedDatasetReader(path, start=True), index)
+
+def _backends(path, matrix):
+    sklearn = pytest.importorskip('sklearn.neighbors')
+    faiss = pytest.importorskip('faiss')
+    flat = faiss.IndexFlatL2(D)
+    flat.add(matrix)
+    brute = MemoryMappedDatasetReader(path, start=True)
+    return {'kdtree': _knn_db(path, sklearn.KDTree(matrix)), 'faiss': _knn_db(path, flat),
+            'brute': KNNDatabase(brute, BruteForceIndex(brute, block_rows=64)),
+            'fallback': load_knn_db(path)} # no trained index on disk
+
+def test_backends_report_euclidean_distances(dataset):
+    path, matrix = dataset
+    queries = matrix[:10] + 0.5
+    expected = np.sort(np.linalg.norm(queries[:, None] - matrix[None], axis=-1), axis=1)[:, :K]
+
+    for name, db in _backends(path, matrix).items():
+        keys, distances = db.nearest_neighbors(queries, k=K)
+        np.testing.assert_allclose(distances, expected, rtol=1e-4, err_msg=name)
+        assert keys[0, 0] == 'seq0', name
+
+def test_inner_product_scores_pass_through(dataset):
+    path, matrix = dataset
+    faiss = pytest.importorskip('faiss')
+    flat = faiss.IndexFlatIP(D)
+    flat.add(matrix)
+    queries = matrix[:10]
+    expected = np.sort(queries @ matrix.T, axis=1)[:, ::-1][:, :K]
+
+    distances, _ = _knn_db(path, flat).search(queries, k=K)
+    np.testing.assert_allclose(distances, expected, rtol=1e-4)
+
+def test_fallback_is_brute_force(dataset):
+    path, _ = dataset
+    assert isinstance(load_knn_db(path).idx, BruteForceIndex)
+
+@pytest.mark.parametrize('kind', ['flat', 'ivf', 'kdtree'])
+def test_built_index_matches_brute_force(dataset, kind):
+    pytest.importorskip('sklearn' if kind == 'kdtree' else 'faiss')
+    from biotoolbox.dbutils.build import build_index
+    path, matrix = dataset
+    params = build_index(path, kind=kind, nlist=4, nprobe=4, k=K, n_queries=32)
+    assert params['recall_at_k'] == 1.0 # nprobe == nlist, the IVF search is exhaustive
+
+    queries = matrix[:10] + 0.5
+    _, distances = load_knn_db(path).nearest_neighbors(queries, k=K)
+    _, exact = load_knn_db(path, backend='brute').nearest_neighbors(queries, k=K)
+    np.testing.assert_allclose(distances, exact, rtol=1e-4)
+
+def test_recall_leaves_out_self_matches():
+    from biotoolbox.dbutils.build import _drop_self, recall_at_k
+    rows  = np.array([3, 7])
+    found = np.array([[3, 1, 2], [5, 6, 8]]) # the second query's self match was missed
+    truth = np.array([[3, 1, 4], [7, 5, 6]])
+    assert recall_at_k(_drop_self(found, rows, 2), _drop_self(truth, rows, 2)) == 0.75
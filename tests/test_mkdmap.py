@@ -0,0 +1,31 @@
+import sys
+import shutil
+import importlib
+
+import pytest
+
+from conftest import REPO, SAMPLES
+
+# mkdmap uses relative imports, so it is imported as a module of the checkout
+sys.path.insert(0, str(REPO.parent))
+mkdmap = importlib.import_module(f"{REPO.name}.mkdmap")
+
+def test_collect_inputs_rejects_shared_output_names(tmp_path):
+    for name in ('a/1abc.pdb', 'a/1abc.cif', 'b/1abc.pdb.gz', 'a/2xyz.pdb'):
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).touch()
+    with pytest.raises(ValueError, match='1abc: '):
+        mkdmap.collect_inputs(tmp_path)
+    assert mkdmap.collect_inputs(tmp_path / 'a' / '2*') == [tmp_path / 'a' / '2xyz.pdb']
+
+def test_batch_writes_one_output_per_structure(tmp_path):
+    inputs = tmp_path / 'inputs'
+    inputs.mkdir()
+    for pdbfile in SAMPLES.glob('*.pdb'):
+        shutil.copy(pdbfile, inputs)
+    options = dict(atom='CA', xyz=False, all_chains=True, dtype=None, cutoff=None,
+                   single_pass=False, columnar=False)
+    pdbfiles = mkdmap.collect_inputs(inputs)
+    assert mkdmap.run_batch(pdbfiles, tmp_path / 'out', **options) == (len(pdbfiles), 0, 0)
+    assert mkdmap.run_batch(pdbfiles, tmp_path / 'out', resume=True, **options) == (0, len(pdbfiles), 0)
+    assert sorted(path.stem for path in (tmp_path / 'out').iterdir()) == sorted(path.stem for path in pdbfiles)
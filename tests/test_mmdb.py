@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from biotoolbox.dbutils.mmdb import MemoryMappedDatasetWriter, MemoryMappedDatasetReader
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16', 'int8'])
+def test_rows_are_writable_copies(tmp_path, dtype):
+    matrix = np.random.default_rng(0).normal(size=(10, 4)).astype(np.float32)
+    writer = MemoryMappedDatasetWriter(tmp_path / 'db', embedding_dim=4, shard_size=4, dtype=dtype, start=True)
+    writer.set_many([f"seq{i}" for i in range(10)], matrix, commit=True)
+    writer.close()
+
+    reader = MemoryMappedDatasetReader(tmp_path / 'db', start=True)
+    before = reader.get_many(range(10))
+    for row in (reader.get('seq5'), reader[5], reader.get_many([5])[0],
+                reader.embedding_matrix[5:6][0], next(iter(reader.embedding_matrix))):
+        assert row.flags.writeable
+        row += 1
+    np.testing.assert_array_equal(reader.get_many(range(10)), before)
+    reader.close()
+
+def test_get_many_takes_numpy_indices(tmp_path):
+    matrix = np.arange(40, dtype=np.float32).reshape(10, 4)
+    writer = MemoryMappedDatasetWriter(tmp_path / 'db', embedding_dim=4, shard_size=4, start=True)
+    writer.set_many([f"seq{i}" for i in range(10)], matrix, commit=True)
+    writer.close()
+
+    reader = MemoryMappedDatasetReader(tmp_path / 'db', start=True)
+    rows = np.array([0, 2, 9])
+    np.testing.assert_array_equal(reader.get_many(rows), matrix[rows])
+    np.testing.assert_array_equal(reader.get(rows[1]), matrix[2])
+
+    found, missing = reader.get_many(rows, strict=False)
+    np.testing.assert_array_equal(found, matrix[rows])
+    assert missing == []
+    partial, missing = reader.get_many(np.array([1, 10]), strict=False)
+    np.testing.assert_array_equal(partial[0], matrix[1])
+    assert np.isnan(partial[1]).all() and missing == [10]
+    reader.close()
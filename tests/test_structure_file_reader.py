@@ -0,0 +1,36 @@
+import pytest
+
+from biotoolbox.structure_file_reader import build_structure_container_for_pdb
+
+from conftest import SAMPLES, as_cif
+
+PDB_FILES = sorted(SAMPLES.glob('*.pdb'))
+
+def _chains(container):
+    return {name: {key: str(value) for key, value in chain.items()} for name, chain in container.chains.items()}
+
+@pytest.mark.parametrize('pdbfile', PDB_FILES, ids=lambda path: path.name)
+def test_single_pass_matches_passes_pdb(pdbfile):
+    data = pdbfile.read_text()
+    single = build_structure_container_for_pdb(data, single_pass=True)
+    passes = build_structure_container_for_pdb(data)
+    assert _chains(single) == _chains(passes)
+    assert single.id_code == passes.id_code
+
+@pytest.mark.parametrize('pdbfile', PDB_FILES, ids=lambda path: path.name)
+def test_single_pass_matches_passes_cif(pdbfile):
+    data = as_cif(pdbfile)
+    single = build_structure_container_for_pdb(data, single_pass=True)
+    passes = build_structure_container_for_pdb(data)
+    assert _chains(single) == _chains(passes)
+    if 'SEQRES' in pdbfile.read_text(): # CATH domains like 1qd5A00 have none
+        assert all(chain['seqres-seq'] for chain in single.chains.values())
+
+@pytest.mark.parametrize('pdbfile', [path for path in PDB_FILES if 'SEQRES' in path.read_text()], ids=lambda path: path.name)
+def test_single_pass_matches_passes_modified_residues(pdbfile):
+    # PCA is Q and 0YG a chromophore (one letter) for SeqIO, but E and YG in SCOP's table
+    data = as_cif(pdbfile, modified=['PCA', '0YG', 'MSE', 'SEP', 'UNK', 'HOH'])
+    single = build_structure_container_for_pdb(data, single_pass=True)
+    passes = build_structure_container_for_pdb(data)
+    assert _chains(single) == _chains(passes)
+    assert all(chain['seqres-seq'].startswith('Q') for chain in _chains(single).values())